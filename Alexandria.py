@@ -1,27 +1,81 @@
 """Contains 'Document' and 'DocumentCollection' classes for Alexandria core search functions"""
 
 import json
-import re
-import pdfplumber
 import os
 import pickle
 import numpy as np
-import math
+from scipy import sparse
+import logging
 from log import addLog
-from wordcloud import WordCloud
-from PIL import Image
+import Ingest
+import Storage
+from Cache import LRUCache
+from Similarity import SimilarityEngine
+from Vocabulary import Vocabulary
+from Index import TermMatrixBuilder, InvertedIndex, growArray, queryMatrix, topKPerRow
+from Model import ModelLoader, QueryLookup
+from Positions import PositionalIndex
+from Scoring import TFIDFScorer
+from WordClouds import WordcloudCache, contentHash
+# pdfplumber, wordcloud and PIL are slow to import and only needed by some features - imported where used
 
 #from Util import *
 
 class Alexandria:
     """Container class for DocumentCollection to hold nlp model outside of library and handle external functionality"""
-    def __init__(self, nlp):
+    # pipeline components whose output is never used (only is_stop, shape_ and lemma_ are read) - skipped for queries
+    # and alphanumeric tokens
+    UNUSED_PIPES = ("parser", "ner", "senter", "entity_ruler", "entity_linker", "textcat", "textcat_multilabel")
+
+    def __init__(self, nlp, queryCacheSize=1024, queryLookup=None, wordclouds=None):
+        """nlp - spaCy model, or a Model.ModelLoader still loading one (waited for when the model is first needed).
+        queryLookup - optional Model.QueryLookup answering simple queries until the model is ready (and learning from
+        the model's answers after).
+        wordclouds - optional WordClouds.WordcloudCache - clouds of newly processed documents are rendered into it in
+        the background (see syncDocs and renderWordclouds)"""
+        self.library = None
+        self.queryLookup = queryLookup
+        self.wordclouds = wordclouds
+
         #umbrella nlp model for text processing across package
         self.nlp = nlp
-        self.library = None
 
-    def processDocs(self, path):
-        """Converts all files with '.txt' or '.pdf' extension in 'TestDocs' folder to JSON formatted Bag of Word dictionaries in 'Processed' folder (_BoW files)"""
+        # lemmatised words of recent queries {raw query text : tuple of words} and alphanumeric tokens
+        # {lower case token : tuple of words}
+        self._queryCache = LRUCache(queryCacheSize)
+        self._tokenCache = LRUCache(queryCacheSize)
+
+    @property
+    def nlp(self):
+        """the spaCy model - waits for it here if it is still loading"""
+        if isinstance(self._nlp, ModelLoader):
+            loader = self._nlp
+            self.nlp = loader.get()
+            addLog("NLP model loaded", loader.modelName + " in " + str(round(loader.loadTime, 2)) + "s")
+
+        return self._nlp
+
+    @nlp.setter
+    def nlp(self, nlp):
+        self._nlp = nlp
+
+        # components of this model to disable on the lightweight path
+        self._unusedPipes = [name for name in getattr(nlp, "pipe_names", []) if name in self.UNUSED_PIPES]
+
+        if self.queryLookup is not None and hasattr(nlp, "Defaults"):
+            self.queryLookup.tokens.update(QueryLookup.fromModel(nlp).tokens)
+
+    @property
+    def modelReady(self):
+        """True unless the model is still loading in the background"""
+        return not isinstance(self._nlp, ModelLoader) or self._nlp.ready
+
+    def processDocs(self, path, workers=1, nlpProcesses=1, batchSize=64, positions=False):
+        """Converts all files with '.txt' or '.pdf' extension in 'TestDocs' folder to JSON formatted Bag of Word dictionaries in 'Processed' folder (_BoW files).
+        workers - number of processes extracting pdf text (1 = in this process)
+        nlpProcesses, batchSize - passed to spaCy's nlp.pipe as n_process / batch_size
+        positions - also save where each word is on each page (_Pos file) for phrase / proximity scoring"""
+        pdfPaths = []
         with os.scandir(path) as items:
             for item in items:
 
@@ -43,82 +97,169 @@ class Alexandria:
                     # myfile.close()
                     # saveFile.close()
 
-                # open .pdf file and read, clean and correct text then create Bag of Words (Dictionary)
+                # .pdf files are read, cleaned and turned into Bags of Words (Dictionary) by the pipeline below
                 elif item.name[-4:] == ".pdf":
-                    print("Processing: ", item.name, "....")
-
-                    txtList = self.extractTextPDF(path + "/" + item.name)
-                    BoWList = []
-
-                    for page in txtList:
-                        doc = self.nlp(self.cleanText(page))
-                        NLPBoW = self.NLPcreateBagOfWords(doc)
-
-                        # add each page (BoW, BoN tuple) to List for saving to file later
-                        BoWList.append(NLPBoW)
-
-                    # save BoWList as a _BoW file in JSON format
-                    saveFile = open(r"Processed/" + item.name[0:-4] + "_BoW.json", "w")
-                    json.dump(BoWList, saveFile)
-                    saveFile.close()
+                    pdfPaths.append(path + "/" + item.name)
 
                 else:
                     print("In function 'processDocs' -", item.name, "not a .txt or .pdf")
 
-        print("Processing Complete")
+        self.processPDFs(pdfPaths, workers, nlpProcesses, batchSize, positions)
 
-    def extractTextPDF(self, pdf_path):
-        """takes pdf_path (from root) and returns list of (pdf) page by page raw text"""
-        pagesOfText = []
+        print("Processing Complete")
 
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                pagesOfText.append(page.extract_text())
+    def processPDFs(self, pdfPaths, workers=1, nlpProcesses=1, batchSize=64, positions=False):
+        """runs each pdf in pdfPaths through extraction -> cleanText -> nlp -> Bag of Words, streaming page by page
+        into a _BoW file in 'Processed' folder (JSON lines, one per page, compacted to _BoW.bin once the document is
+        finished - see Ingest.BoWWriter), so memory use doesn't grow with document size. A document left part
+        processed by a crash carries on from where it got to. With positions, each page's word positions go to a
+        _Pos.jsonl file the same way. Returns list of docNames saved (unreadable pdfs are left out)"""
+        docPaths = {os.path.basename(pdfPath)[:-4]: pdfPath for pdfPath in pdfPaths}
+
+        # pages already written by an interrupted run don't need extracting again
+        startPages = {}
+        for docName, pdfPath in docPaths.items():
+            startPages[pdfPath] = Ingest.resumeBoW(r"Processed/" + docName + "_BoW.bin", pdfPath)
+
+            # both files have to have got to the same page to carry on
+            if positions:
+                if Ingest.resumeBoW(r"Processed/" + docName + Ingest.POS_SUFFIX, pdfPath) != startPages[pdfPath]:
+                    startPages[pdfPath] = 0
+
+            if startPages[pdfPath]:
+                print("Resuming: ", docName, "from page", startPages[pdfPath] + 1)
+
+        pages = Ingest.iterPages(pdfPaths, workers, startPages=startPages)
+        saved = []
+
+        # _BoW (and _Pos) files of docs still in the pipeline {docName : BoWWriter}
+        writers = {}
+        positionWriters = {}
+
+        def writer(docName, writers=writers, suffix="_BoW.bin"):
+            if docName not in writers:
+                pdfPath = docPaths[docName]
+                writers[docName] = Ingest.BoWWriter(r"Processed/" + docName + suffix, pdfPath,
+                                                    resume=startPages[pdfPath] > 0)
+            return writers[docName]
+
+        for doc, (docName, pageNo) in self.nlp.pipe(pages, as_tuples=True, batch_size=batchSize, n_process=nlpProcesses):
+
+            if pageNo == Ingest.PAGES_DONE:
+                print("Processed: ", docName)
+
+                # put the finished file in place (replacing an older version, in any _BoW format)
+                writer(docName).close()
+                del writers[docName]
+                oldSuffixes = list(Ingest.BOW_SUFFIXES[1:])
+                if positions:
+                    writer(docName, positionWriters, Ingest.POS_SUFFIX).close()
+                    del positionWriters[docName]
+                else:
+                    oldSuffixes += [Ingest.POS_SUFFIX, Ingest.POS_SUFFIX + ".part"]
+                for suffix in oldSuffixes:
+                    if os.path.exists(r"Processed/" + docName + suffix):
+                        os.remove(r"Processed/" + docName + suffix)
+                saved.append(docName)
 
-        return pagesOfText
+            elif pageNo == Ingest.PAGES_FAILED:
+                for docWriters in (writers, positionWriters):
+                    if docName in docWriters:
+                        docWriters.pop(docName).abandon()
 
-    def cleanText(self, text):
-        """takes text and cleans it by:
-        -removing unwanted lines
-        -removing commas
-        -removing brackets (need to consider this carefully in future for acronyms)
-        -additional spaces"""
+            else:
+                # each page is written out as soon as it is through nlp
+                pagePositions = {} if positions else None
+                writer(docName).writePage(self.NLPcreateBagOfWords(doc, pagePositions))
+                if positions:
+                    writer(docName, positionWriters, Ingest.POS_SUFFIX).writePage(pagePositions)
+
+        return saved
+
+    def syncDocs(self, path, workers=1, nlpProcesses=1, batchSize=64, positions=False):
+        """brings 'Processed' folder and self.library up to date with the pdfs in path, only processing new or changed
+        files (tracked in 'Processed/manifest.json' by size, mtime and content hash) and dropping deleted ones.
+        positions - save page positions of processed documents too (see processPDFs).
+        Returns True if anything changed"""
+        manifest = Ingest.Manifest(r"Processed/manifest.json")
+        added, changed, deleted = manifest.changes(path)
+
+        saved = self.processPDFs([path + "/" + name for name in added + changed], workers, nlpProcesses, batchSize,
+                                 positions)
+        for docName in saved:
+            manifest.record(path + "/" + docName + ".pdf")
+
+        for name in deleted:
+            docName = name[:-4]
+            for oldFile in [r"Processed/" + docName + suffix for suffix in Ingest.BOW_SUFFIXES] + \
+                           [r"Processed/" + docName + Ingest.POS_SUFFIX, r"Processed/" + docName + ".jpg"]:
+                if os.path.exists(oldFile):
+                    os.remove(oldFile)
+            manifest.remove(name)
+
+        manifest.save()
+
+        if self.library is None:
+            self.createLibrary()
+            self.renderWordclouds()
+            return True
 
+        # update the library in place - tombstone deleted docs and swap in the freshly processed versions
+        for name in deleted:
+            docID = self.library.findDoc(name[:-4])
+            if docID is not None:
+                self.library.removeDoc(docID)
+
+        for docName in saved:
+            doc = self.loadProcessedDoc(docName)
+            docID = self.library.findDoc(docName)
+            if docID is None:
+                self.library.addDoc(doc)
+            else:
+                self.library.replaceDoc(docID, doc)
 
-        # remove single quotes (commented out for now as leads to "didn't" becoming "didnt" which confuses spacy/nlp)
-        # text = re.sub('\'', '', text)
+            # a changed doc's content hash changes, so it gets a new cloud - the old one ages out of the cache
+            if self.wordclouds is not None:
+                self.wordclouds.submit(doc)
 
-        # remove unwanted lines starting from special charcters
-        text = re.sub(r'\n: \'\'.*', '', text)
-        text = re.sub(r'\n!.*', '', text)
-        text = re.sub(r'^:\'\'.*', '', text)
+        print("Sync Complete -", len(added), "added,", len(changed), "changed,", len(deleted), "deleted")
 
-        # remove non-breaking new line characters
-        text = re.sub(r'\n', ' ', text)
+        return bool(added or changed or deleted)
 
-        # remove digits and words containing digits (commented out as I want to process digits)
-        # text = re.sub('\w*\d\w*', '', text)
+    def renderWordclouds(self, docIDs=None):
+        """starts rendering the word clouds of library documents docIDs (default all of them) in the background, so
+        they are ready when asked for - does nothing without a wordcloud cache"""
+        if self.wordclouds is None or self.library is None:
+            return
 
-        # remove punctuations (commented out as it causes confusion with "didn't" for example)
-        # text = re.sub(r'[^\w\s]', ' ', text)
+        for docID in range(len(self.library.myDocs)) if docIDs is None else docIDs:
+            if self.library.myDocs.name(docID) is not None:
+                self.wordclouds.submit(self.library.myDocs[docID])
 
-        # remove commas - they provide no added benefit and confuse processing of large numbers
-        text = re.sub(",", "", text)
+    def returnWordcloud(self, docID):
+        """returns Pillow Image of the word cloud of library document docID (see Document.returnWordcloud)"""
+        return self.library.myDocs[docID].returnWordcloud(self.wordclouds)
 
-        # remove brackets as they cause confusion with NLP processor - might have to consider this is future for acronym handling
-        text = re.sub(r"[\([{})\]]", " ", text)
+    def extractTextPDF(self, pdf_path):
+        """takes pdf_path (from root) and yields (pdf) page by page raw text"""
+        import pdfplumber
 
-        # replace extra spaces with single space
-        text = re.sub(' +', ' ', text)
+        with pdfplumber.open(pdf_path) as pdf:
+            for page in pdf.pages:
+                text = page.extract_text()
+                page.flush_cache()
 
-        # lowercase - removed from here as wish to preserve original text for Acronym handling later
-        # text = text.lower()
+                yield text
 
-        return text
+    def cleanText(self, text):
+        """takes text and cleans it (see Ingest.cleanText)"""
+        return Ingest.cleanText(text)
 
-    def NLPcreateBagOfWords(self, doc):
-        """returns dictionary of lemmatised bag of words 'word : frequency' pairs having removed stop words, numbers and tokens length 2 or below"""
+    def NLPcreateBagOfWords(self, doc, positions=None):
+        """returns dictionary of lemmatised bag of words 'word : frequency' pairs having removed stop words, numbers and tokens length 2 or below.
+        positions - optional dictionary filled with 'word : [positions]' (each word's numbers among the words kept)"""
         BOWDict = {}
+        position = 0
 
         for token in doc:
 
@@ -132,30 +273,35 @@ class Alexandria:
 
                     # split token into list of letter only and digit only 'words'
                     listWords = self.handleAlphaNumericToken(token)
-
-                    # add to dictionary for return (increment if existing or create new if not
-                    for word in listWords:
-                        if word in BOWDict:
-                            BOWDict[word] += 1
-                        else:
-                            BOWDict[word] = 1
                 else:
 
                     # lower case and lemmatise
-                    word = (token.lemma_).lower()
+                    listWords = [(token.lemma_).lower()]
 
+                # add to dictionary for return (increment if existing or create new if not
+                for word in listWords:
                     if word in BOWDict:
                         BOWDict[word] += 1
                     else:
                         BOWDict[word] = 1
 
+                    if positions is not None:
+                        positions.setdefault(word, []).append(position)
+                    position += 1
+
         return BOWDict
 
     def handleAlphaNumericToken(self, token):
         """token = spacy token confirmed as alphanumeric, returns list of separated numbers and words (char only)"""
 
         # create lower case string
-        text = token.lower_
+        tokenText = token.lower_
+        text = tokenText
+
+        # the same tokens (part numbers, references...) come up again and again
+        cached = self._tokenCache.get(tokenText)
+        if cached is not None:
+            return list(cached)
 
         # split string into list of characters
         textList = list(text)
@@ -181,7 +327,7 @@ class Alexandria:
         text = "".join(textList)
 
         # tokenise string and create list of strings (lemmatised)
-        doc = self.nlp(text)
+        doc = self.nlp(text, disable=self._unusedPipes)
         listWords = []
 
         for token in doc:
@@ -189,18 +335,44 @@ class Alexandria:
             word = (token.lemma_).lower()
             listWords.append(word)
 
+        self._tokenCache.put(tokenText, tuple(listWords))
+
         return listWords
 
+    def loadLibrary(self, path, cacheSize=32):
+        """opens self.library (a DocumentCollection object) from the on-disk index directory at path (see Storage).
+        cacheSize - number of documents' page indexes kept loaded. Returns True if successful, False if not"""
+        try:
+            self.library = DocumentCollection.fromStore(Storage.IndexStore(path), cacheSize)
+            return True
+        except (OSError, ValueError, KeyError) as e:
+            print("Could not open library index '" + path + "' :", e)
+            return False
+
+    def saveLibrary(self, path):
+        """saves self.library as an on-disk index directory at path (see Storage)"""
+        if self.library is not None:
+            Storage.saveCollection(self.library, path)
+        else:
+            print ("No library to save to file (in 'Alexandria.saveLibrary')")
+
     def loadLibraryFromPickle(self,path):
         """loads self.library (a DocumentCollection object) from pickle file at path. Returns True if successful, False if not"""
         try:
             file = open(path, 'rb')
             self.library = pickle.load(file)
             file.close()
-            return True
         except:
             return False
 
+        # libraries pickled before the sparse backend (or the shared vocabulary, or scorers) need regenerating
+        if not sparse.issparse(self.library.myArray) or not hasattr(self.library, "vocabulary") or \
+                not hasattr(self.library, "_pageCounts"):
+            self.library = None
+            return False
+
+        return True
+
     def saveLibraryToPickle(self, path):
         if self.library is not None:
             self.library.pickleToFile(path)
@@ -208,29 +380,94 @@ class Alexandria:
             print ("No library to save to file (in 'Alexandria.saveLibraryToPickle')")
 
     def createLibrary(self):
-
-        docList = []
+        """builds self.library from all _BoW files in 'Processed' folder"""
+        vocabulary = Vocabulary()
+        self.library = DocumentCollection((self.loadProcessedDoc(docName, vocabulary)
+                                           for docName in self.processedDocNames()), vocabulary)
+
+    def processedDocNames(self):
+        """returns list of docNames with a _BoW file (in any format) in 'Processed' folder"""
+        docNames = {}
         with os.scandir("Processed") as items:
             for item in items:
-                f = open(r"Processed/" + item.name, "r")
-                data = json.load(f)
-                f.close()
+                # 'Processed' also holds wordcloud images and unfinished .part files
+                for suffix in Ingest.BOW_SUFFIXES:
+                    if item.name.endswith(suffix):
+                        docNames[item.name[:-len(suffix)]] = True
+
+        return list(docNames)
+
+    def processedDocPath(self, docName):
+        """returns path of docName's _BoW file in 'Processed' folder (the binary one if there are several)"""
+        for suffix in Ingest.BOW_SUFFIXES:
+            if os.path.exists(r"Processed/" + docName + suffix):
+                return r"Processed/" + docName + suffix
+
+        raise FileNotFoundError("No _BoW file for '" + docName + "' in 'Processed' folder")
+
+    def loadProcessedDoc(self, docName, vocabulary=None):
+        """returns 'Document' built from docName's _BoW file in 'Processed' folder - a _BoW.bin file goes straight
+        into the page matrix without making a dict per page. vocabulary - 'Vocabulary' to share (the library's if
+        there is one)"""
+        if vocabulary is None and self.library is not None:
+            vocabulary = self.library.vocabulary
+
+        path = self.processedDocPath(docName)
+        if path.endswith(".bin"):
+            words, pages = Ingest.readBinaryBoW(path)
+            doc = Document.fromArrays(docName, words, pages, vocabulary)
+        else:
+            doc = Document.fromPages(docName, self.readProcessedDoc(docName), vocabulary)
+
+        # page positions, if they were saved
+        if os.path.exists(r"Processed/" + docName + Ingest.POS_SUFFIX):
+            doc.setPositions(Ingest.readBoW(r"Processed/" + docName + Ingest.POS_SUFFIX))
 
-                doc = Document(item.name[:-9], data[0])
-                for page in data[1:]:
-                    doc.addPage(page)
+        return doc
 
-                docList.append(doc)
+    def readProcessedDocs(self):
+        """yields (docName, page BoW dicts) for each document with a _BoW file in 'Processed' folder"""
+        for docName in self.processedDocNames():
+            yield docName, self.readProcessedDoc(docName)
 
-            self.library = DocumentCollection(docList)
+    def readProcessedDoc(self, docName):
+        """returns page BoW dicts from docName's _BoW file in 'Processed' folder (read a page at a time unless it is
+        an older single JSON list file)"""
+        path = self.processedDocPath(docName)
+        if path.endswith(".bin"):
+            return Ingest.iterBinaryBoW(path)
+
+        if path.endswith(".jsonl"):
+            return Ingest.readBoW(path)
+
+        f = open(path, "r")
+        data = json.load(f)
+        f.close()
+
+        return data
 
     def processInput(self, text):
         """take raw text (text) and process to output list of lemmatised and lower case words"""
         addLog("Search Conducted", text)
+
+        # repeated queries are answered from the cache without running the model
+        cached = self._queryCache.get(text)
+        if cached is not None:
+            return list(cached)
+
+        # while the model is loading, queries made only of known tokens are answered from the lookup table (not
+        # cached, so the model's own answer is used once it is ready)
+        if self.queryLookup is not None and not self.modelReady:
+            searchWords = self.queryLookup.searchWords(text)
+            if searchWords is not None:
+                addLog("Search answered from lookup table", searchWords, logging.DEBUG)
+                return searchWords
+
         searchWords = []
-        NLPtext = self.nlp(text)
+        NLPtext = self.nlp(text, disable=self._unusedPipes)
 
         for token in NLPtext:
+            tokenWords = []
             if (not token.is_stop
                     and len(token.text) > 2):
 
@@ -239,235 +476,941 @@ class Alexandria:
                         and ('X' in token.shape_ or 'x' in token.shape_)):
 
                     # split token into list of letter only and digit only 'words'
-                    listWords = self.handleAlphaNumericToken(token)
-
-                    searchWords += listWords
+                    tokenWords = self.handleAlphaNumericToken(token)
 
                 else:
 
                     # lower case and lemmatise
-                    word = token.lemma_.lower()
+                    tokenWords = [token.lemma_.lower()]
+
+            searchWords += tokenWords
+            if self.queryLookup is not None:
+                self.queryLookup.add(token.lower_, tokenWords)
 
-                    searchWords.append(word)
+        self._queryCache.put(text, tuple(searchWords))
 
         return searchWords
 
 class Document:
-    """myArray - rows are unique words, columns are 'documents'"""
-    def __init__(self, docName, initialBoWDict):
-
-        self.numPages = 1
+    """myArray - rows are unique words, columns are 'pages' (scipy sparse CSC matrix of raw frequencies).
+    Words are held as their IDs in a shared 'Vocabulary' (usually the collection's) - myTermIDs gives the ID of each row.
+    Word totals and page counts are kept up to date as pages are added; the search index is rebuilt lazily.
+    Pages are ranked by 'scorer' (see Scoring.py) - TF-IDF without scaling for the number of words on a page, as that
+    tends to bias towards pages with few words on them"""
+    scorer = TFIDFScorer(lengthNorm=False)
+    # see contentHash - None until first asked for (and again once a page is added)
+    _contentHash = None
+
+    def __init__(self, docName, initialBoWDict=None, vocabulary=None):
+
+        self.numPages = 0
         #doc name (could be used for path)
         self.myName = docName
-        #this is for indexing each unique word {Word1 : 0, Word2 : 1, Word3 : 2...}
-        self.myWordsDict = {}
-        #totals of each row - for calculating overall frequency in document
-        self.myWordFreq = []
-
-        tempFreqList = []
-        for word in initialBoWDict:
-            self.myWordsDict[word] = len(self.myWordsDict)
-            tempFreqList.append(initialBoWDict[word])
-
-        self.myArray = np.array([tempFreqList],dtype=np.float_).T
-        self.myWordFreq = tempFreqList
+        #term <-> ID table, shared with the collection (and its other documents) where there is one
+        self.vocabulary = Vocabulary() if vocabulary is None else vocabulary
+        #vocabulary ID of each row (buffer - see myTermIDs) and the rows in term ID order (for lookups, see _rowsOf)
+        self._termIDs = np.zeros((64,), dtype=np.int64)
+        self.numWords = 0
+        self._rowOrder = None
+        #accumulates page columns with amortised growth (recreated from myArray after unpickling)
+        self._builder = TermMatrixBuilder()
+        self.myArray = self._builder.toCSC()
+        #optional positional index (see setPositions)
+        self.positions = None
+        #totals of each row and number of pages each word is on (buffers - see myWordFreq / myPageFreq)
+        self._wordFreq = np.zeros((64,))
+        self._pageFreq = np.zeros((64,), dtype=np.int64)
+
+        if initialBoWDict is not None:
+            self.addPage(initialBoWDict)
 
         # make sure the TFID Array is initialised for first doc entry
         self.updateTFIDArray()
 
+    @classmethod
+    def fromPages(cls, docName, pages, vocabulary=None):
+        """builds a Document from a list of page BoW dicts - words are looked up in (or added to) the vocabulary in one
+        go once every page is read (TFID Array is calculated once, on first use)"""
+        rowOfWord = {}
+        builder = TermMatrixBuilder()
+        for page in pages:
+            #new words get the next index (a new row at the bottom)
+            rows = [rowOfWord.setdefault(word, len(rowOfWord)) for word in page]
+            builder.addColumn(rows, list(page.values()), len(rowOfWord))
+
+        vocabulary = Vocabulary() if vocabulary is None else vocabulary
+        return cls.fromTermIDs(docName, vocabulary.addMany(rowOfWord), builder.toCSC(), vocabulary)
+
+    @classmethod
+    def fromArrays(cls, docName, words, pages, vocabulary=None):
+        """builds a Document straight from its list of words (row order) and page matrix (CSC, words x pages), e.g.
+        one read from a _BoW.bin file"""
+        vocabulary = Vocabulary() if vocabulary is None else vocabulary
+        return cls.fromTermIDs(docName, vocabulary.addMany(words), pages, vocabulary)
+
+    @classmethod
+    def fromTermIDs(cls, docName, termIDs, pages, vocabulary):
+        """builds a Document from the vocabulary ID of each row and its page matrix (CSC, words x pages), e.g. one read
+        back from an on-disk index. pages is used as is (memory mapped arrays are not copied)"""
+        doc = cls.__new__(cls)
+        doc.numPages = pages.shape[1]
+        doc.myName = docName
+        doc.vocabulary = vocabulary
+        doc._termIDs = np.array(termIDs, dtype=np.int64)
+        doc.numWords = len(termIDs)
+        doc._rowOrder = None
+        doc._builder = None
+        doc.myArray = pages
+        doc.positions = None
+        doc._wordFreq = np.bincount(pages.indices, weights=pages.data, minlength=doc.numWords)
+        doc._pageFreq = np.bincount(pages.indices, minlength=doc.numWords)
+        doc._TFIDFStale = True
+
+        return doc
+
     def __str__(self):
         return self.myName
 
-    def addPage(self,BoWDict):
+    def __getstate__(self):
+        # the builder's spare capacity is not worth pickling - it is rebuilt from myArray on the next addPage
+        state = self.__dict__.copy()
+        state["_builder"] = None
+        state["_rowOrder"] = None
+        state["_termIDs"] = self.myTermIDs.copy()
+        state["_wordFreq"] = self.myWordFreq.copy()
+        state["_pageFreq"] = self.myPageFreq.copy()
+        state["_index"] = None
+        state["_TFIDFStale"] = True
+        return state
+
+    @property
+    def myTermIDs(self):
+        """vocabulary ID of each word (indexed as the rows of myArray)"""
+        return self._termIDs[:self.numWords]
+
+    @property
+    def myWordsDict(self):
+        """{word : row} of every word in the document - built on each call, use myTermIDs where possible"""
+        return {word: row for row, word in enumerate(self.vocabulary.terms(self.myTermIDs))}
+
+    @property
+    def myWordFreq(self):
+        """total frequency of each word across all pages (indexed as myTermIDs)"""
+        return self._wordFreq[:self.numWords]
+
+    @property
+    def myPageFreq(self):
+        """number of pages each word appears on (indexed as myTermIDs)"""
+        return self._pageFreq[:self.numWords]
+
+    @property
+    def contentHash(self):
+        """hex digest of the document's words and their total frequencies (see WordClouds.contentHash) - worked out
+        once and kept until a page is added, as it reads every word"""
+        if self._contentHash is None:
+            self._contentHash = contentHash(*self.getWordFreqArrays())
+
+        return self._contentHash
+
+    @property
+    def index(self):
+        """InvertedIndex of the pages (scored by scorer) - rebuilt here if pages have been added since it was built"""
+        if self._TFIDFStale:
+            self.updateTFIDArray()
+
+        return self._index
+
+    def setScorer(self, scorer):
+        """ranks pages by scorer (see Scoring.py) from now on"""
+        if scorer is not self.scorer:
+            self.scorer = scorer
+            self._TFIDFStale = True
+
+    def _rowsOf(self, termIDs, add=False):
+        """returns int64 array of the rows of vocabulary termIDs in this document (-1 for any not in it). With add,
+        IDs not in it are given the next rows (new rows at the bottom, in order of first appearance)"""
+        termIDs = np.asarray(termIDs, dtype=np.int64)
+        if self._rowOrder is None:
+            self._rowOrder = np.argsort(self.myTermIDs, kind="stable")
+
+        sortedIDs = self.myTermIDs[self._rowOrder]
+        rows = np.full(len(termIDs), -1, dtype=np.int64)
+        if len(sortedIDs):
+            found = np.minimum(np.searchsorted(sortedIDs, termIDs), len(sortedIDs) - 1)
+            match = sortedIDs[found] == termIDs
+            rows[match] = self._rowOrder[found[match]]
+
+        if add and np.any(rows < 0):
+            new = np.flatnonzero(rows < 0)
+            newIDs, first, inverse = np.unique(termIDs[new], return_index=True, return_inverse=True)
+            # rank of each new ID by first appearance
+            rank = np.empty(len(newIDs), dtype=np.int64)
+            rank[np.argsort(first)] = np.arange(len(newIDs))
+            newRows = self.numWords + rank
+            rows[new] = newRows[inverse.ravel()]
+
+            self._termIDs = growArray(self._termIDs, self.numWords + len(newIDs))
+            self._termIDs[newRows] = newIDs
+            self.numWords += len(newIDs)
+
+            # the new IDs are merged into the sorted order rather than sorting every row again
+            self._rowOrder = np.insert(self._rowOrder, np.searchsorted(sortedIDs, newIDs), newRows)
+
+        return rows
+
+    def useVocabulary(self, vocabulary):
+        """moves the document over to vocabulary (e.g. the collection's) - its words are added there if new"""
+        if vocabulary is self.vocabulary:
+            return
+
+        termIDs = vocabulary.addMany(self.vocabulary.terms(self.myTermIDs))
+        self._termIDs = growArray(termIDs, len(self._termIDs))
+        self._rowOrder = None
+        self.vocabulary = vocabulary
+
+    def remapTerms(self, newID, vocabulary):
+        """moves the document over to compacted vocabulary - newID gives the new ID of each old one (see
+        DocumentCollection.compactVocabulary)"""
+        self._termIDs = growArray(newID[self.myTermIDs], len(self._termIDs))
+        self._rowOrder = None
+        self.vocabulary = vocabulary
+
+    def addPage(self, BoWDict, updateTFID = False):
+        """adds a page column. Only the page's own words are touched - the TFID Array is recomputed lazily
+        on next use unless updateTFID is True"""
         self.numPages += 1
-        tempList = []
-        for i in range(len(self.myWordsDict)):
-            tempList.append([0])
-        self.myArray = np.append(self.myArray, tempList, axis=1)
-        for word in BoWDict:
-            if word in self.myWordsDict:
-                self.myArray[self.myWordsDict[word],self.numPages-1] = BoWDict[word]
-            else:
-                #add additional row at bottom for new word with updated element at far right
-                tempList2 = []
-                for i in range(self.numPages-1):
-                    tempList2.append(0)
-                #add the new word's frequency for the new doc
-                tempList2.append(BoWDict[word])
-                self.myArray = np.append(self.myArray, [tempList2], axis=0)
-
-                #update self.myWordsDict to include new word (with indexing)
-                self.myWordsDict[word] = len(self.myWordsDict)
-        self.myWordFreq = np.sum(self.myArray, axis=1)
-
-        #make sure the TFID Array is updated for new doc
-        self.updateTFIDArray()
+        rows = self._rowsOf(self.vocabulary.addMany(BoWDict), add=True)
+        freqs = np.fromiter(BoWDict.values(), dtype=np.float64, count=len(BoWDict))
 
-    def getWordFreqTotalPairs(self):
-        """returns a dictionary of all unique words in document with frequency of occurrence in form {word: freq}"""
-        dict = {}
-        for word in self.myWordsDict:
-            dict[word] = self.myWordFreq[self.myWordsDict[word]]
+        if self._builder is None:
+            self._builder = TermMatrixBuilder.fromMatrix(self.myArray)
 
-        return dict
+        self._builder.addColumn(rows, freqs, self.numWords)
+        self.myArray = self._builder.toCSC()
 
-    def updateTFIDArray(self):
-        # adjusted raw freq array used for conducting searches by page in this case
-        self.TFIDFArray = self.myArray.copy()
+        # keep word totals and page counts current (rows are unique within a page)
+        self._wordFreq = growArray(self._wordFreq, self.numWords)
+        self._pageFreq = growArray(self._pageFreq, self.numWords)
+        self._wordFreq[rows] += freqs
+        self._pageFreq[rows] += freqs != 0
 
-        columnSum = np.sum(self.TFIDFArray,axis = 0)
+        self._contentHash = None
+        self._TFIDFStale = True
+        if updateTFID:
+            self.updateTFIDArray()
 
-        #I've removed the scaling for number of words/tokens on the page as it tends to bias towards pages with few words on them
-        #for x in range(len(columnSum)):
-            #self.TFIDFArray[:,x] /= columnSum[x]
+    def setPositions(self, pagePositions):
+        """builds the positional index from an iterable of page {word : [positions]} dicts (e.g. a _Pos.jsonl file,
+        see Alexandria.processPDFs), one per page in page order. Pages added after this have no positions"""
+        self.positions = PositionalIndex.fromPages(
+            pagePositions, lambda words: self._rowsOf(self.vocabulary.idsOf(words)), self.numWords)
 
-        rows = (np.count_nonzero(self.TFIDFArray, axis = 1))
+    def proximity(self, listWords, window):
+        """returns (pages, score bonuses) of the pages holding all of listWords as a phrase or within window words of
+        each other (see Positions.PositionalIndex.proximity) - nothing if the document has no positional index"""
+        rows = self._rowsOf(self.vocabulary.idsOf(listWords))
+        if self.positions is None or np.any(rows < 0):
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
 
-        for x in range(len(rows)):
-            self.TFIDFArray[x,:] *= math.log(len(columnSum)/rows[x])
+        # repeated words only count once (in the place they first come)
+        return self.positions.proximity(list(dict.fromkeys(rows.tolist())), window)
 
-    def search(self,listWords):
-        """listWords must be pre-processed by NLP to lemmatised words list """
-        addLog("Search conducted within Document", str(listWords))
+    def getWordFreqTotalPairs(self):
+        """returns a dictionary of all unique words in document with frequency of occurrence in form {word: freq}"""
+        return dict(zip(self.vocabulary.terms(self.myTermIDs), self.myWordFreq.tolist()))
 
-        row = np.zeros((self.numPages,))
-        for word in listWords:
+    def getWordFreqArrays(self):
+        """returns (list of unique words, array of their total frequencies) - same order as 'myTermIDs'"""
+        return self.vocabulary.terms(self.myTermIDs), self.myWordFreq
 
-            if word in self.myWordsDict:
-                row += self.TFIDFArray[self.myWordsDict[word]]
-            else:
-                addLog("Search Word not found in document", word)
+    def getTermFreqArrays(self):
+        """returns (array of vocabulary IDs of the unique words, array of their total frequencies)"""
+        return self.myTermIDs, self.myWordFreq
 
-        sortedRow = []
+    def updateTFIDArray(self):
+        """works out the scorer's word and page arrays and rebuilds the page index from the raw frequencies (named from
+        when this built a TF-IDF matrix)"""
+        scorer = self.scorer
+        lengths = np.asarray(self.myArray.sum(axis=0)).ravel()
+        self._index = InvertedIndex(self.myArray, scorer, scorer.idf(self.numPages, self.myPageFreq),
+                                    scorer.norms(lengths, np.ones(self.numPages, dtype=bool)))
+        self._TFIDFStale = False
 
-        for i,v in enumerate(row):
-            sortedRow.append((i,v))
+    def search(self,listWords, window=None):
+        """listWords must be pre-processed by NLP to lemmatised words list.
+        window - pages with the words as a phrase or within window words of each other score higher (see proximity)"""
+        addLog("Search conducted within Document", listWords, logging.DEBUG)
 
-        sortedRow = sorted(sortedRow, key=lambda i: i[1])
+        rows = self._rowsOf(self.vocabulary.idsOf(listWords))
+        for i in np.flatnonzero(rows < 0).tolist():
+            addLog("Search Word not found in document", listWords[i], logging.DEBUG)
 
-        return sortedRow
+        row = self.index.scores(rows[rows >= 0])
 
-    def returnTextStringOfUniqueWordsFrequency(self) -> str:
-        """combines all unique words : frequency into a string (including multiple entries of same word.
-        For use by word cloud"""
-        text = ""
-        dict = self.getWordFreqTotalPairs()
-        for word in dict:
+        if window is not None:
+            pages, bonuses = self.proximity(listWords, window)
+            row[pages] *= 1 + bonuses
 
-            text = text + ' '.join([word] * int(dict[word])) + ' '
+        sortedRow = []
 
-        return text
+        for i,v in enumerate(row):
+            sortedRow.append((i,v))
 
-    def returnWordcloud(self):
-        """checks for jpg in 'Processed' folder. Creates wordcloud if not existant
-        Returns Pillow Image"""
+        sortedRow = sorted(sortedRow, key=lambda i: i[1])
 
-        filepath = r"Processed/" + self.myName + ".jpg"
-        if os.path.exists(filepath):
-            return Image.open(filepath)
+        return sortedRow
 
-        else:
-            wordcloud = WordCloud(width=3000, height=2000, random_state=1,
-                              collocations=False, colormap="Blues").generate(
-                self.returnTextStringOfUniqueWordsFrequency())
+    def topPages(self, listWords, m=1, window=None, proximity=None, termIDs=None):
+        """returns list of (page, score) of the m best pages for listWords, highest first (ties by page). Scored as by
+        search, but picked by partial selection rather than sorting every page.
+        proximity - (pages, bonuses) already worked out by proximity(listWords, window), if they have been.
+        termIDs - vocabulary IDs of listWords, if already looked up"""
+        rows = self._rowsOf(self.vocabulary.idsOf(listWords) if termIDs is None else termIDs)
+        row = self.index.scores(rows[rows >= 0])
+
+        if window is not None:
+            pages, bonuses = self.proximity(listWords, window) if proximity is None else proximity
+            row[pages] *= 1 + bonuses
+
+        pages = np.arange(len(row))
+        if m < len(row):
+            # everything tied with the m-th score stays in so ties are broken by page below
+            pages = np.flatnonzero(row >= -np.partition(-row, m - 1)[m - 1])
+
+        order = np.lexsort((pages, -row[pages]))[:m]
+        return list(zip(pages[order].tolist(), row[pages[order]].tolist()))
+
+    def searchBatch(self, listOfQueries, k=None):
+        """searches several pre-processed word lists at once (one sparse matrix product for all of them). Returns a
+        list holding, for each query, what search would - (page, score) tuples lowest match first - or just the last
+        (best) k of them if k is given"""
+        addLog("Batch search conducted within Document", len(listOfQueries), logging.DEBUG)
+
+        # every query's words looked up together
+        lengths = [len(listWords) for listWords in listOfQueries]
+        starts = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        rows = self._rowsOf(self.vocabulary.idsOf([word for listWords in listOfQueries for word in listWords]))
+        queries = [[row for row in rows[starts[i]:starts[i + 1]].tolist() if row >= 0] for i in range(len(lengths))]
+        queryRows = [row for query in queries for row in query]
+        scores = (queryMatrix(queries, self.numWords) @ self.index.rowWeights(queryRows)).toarray()
+
+        results = []
+        for row in scores:
+            # stable, so equal scores stay in page order as in search
+            order = np.argsort(row, kind="stable")
+            if k is not None:
+                order = order[max(len(order) - k, 0):] if k > 0 else order[:0]
+            results.append(list(zip(order.tolist(), row[order].tolist())))
+
+        return results
 
-            wordcloud.to_file(filepath)
-            return Image.open(filepath)
+    def returnTextStringOfUniqueWordsFrequency(self) -> str:
+        """combines all unique words : frequency into a string (including multiple entries of same word).
+        No longer used by the word cloud, which is drawn from the frequencies (see returnWordcloud)"""
+        words, freqs = self.getWordFreqArrays()
+
+        # joined once rather than concatenated word by word
+        return " ".join(word for word, freq in zip(words, freqs.tolist()) for i in range(int(freq)))
+
+    def returnWordcloud(self, cache=None):
+        """returns Pillow Image of the document's word cloud, drawn from its word frequencies.
+        cache - WordClouds.WordcloudCache to take it from (or render it into), by default one in 'Processed' rendering
+        in this thread"""
+        if cache is None:
+            cache = WordcloudCache(workers=0)
+
+        return cache.get(self)
+
+class DocumentList:
+    """list-like holder of a collection's 'Document' objects (indexed by docID, None for removed documents).
+    Documents from an on-disk index are only loaded (hydrated) when accessed and kept in a bounded LRU cache, so just the
+    recently used page indexes stay in memory - treat them as read only, changes are lost when they drop out of the
+    cache. Documents added since the index was opened are held directly"""
+    def __init__(self, store=None, vocabulary=None, cacheSize=32):
+        # per docID - a Document, a docID in the store (not yet loaded) or None (removed)
+        self._entries = []
+        self._names = []
+        self._store = store
+        self._vocabulary = vocabulary
+        # new vocabulary ID of each store word index once the vocabulary has been compacted (None - the same)
+        self._termMap = None
+        self._cache = LRUCache(cacheSize)
+
+    @classmethod
+    def fromStore(cls, store, vocabulary, cacheSize=32):
+        """list of every document in a Storage.IndexStore (vocabulary - read from the store, so its IDs are the store's
+        word indexes), none loaded yet"""
+        docs = cls(store, vocabulary, cacheSize)
+        docs._entries = list(range(len(store.docNames)))
+        docs._names = list(store.docNames)
+
+        return docs
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        for docID in range(len(self._entries)):
+            yield self[docID]
+
+    def __getitem__(self, docID):
+        entry = self._entries[docID]
+        if entry is None or isinstance(entry, Document):
+            return entry
+
+        doc = self._cache.get(entry)
+        if doc is None:
+            words, pages = self._store.documentArrays(entry)
+            if self._termMap is not None:
+                words = self._termMap[words]
+            doc = Document.fromTermIDs(self._names[docID], words, pages, self._vocabulary)
+            doc.positions = self._store.documentPositions(entry)
+            self._cache.put(entry, doc)
+
+        return doc
+
+    def __setitem__(self, docID, doc):
+        self._entries[docID] = doc
+        self._names[docID] = None if doc is None else doc.myName
+
+    def append(self, doc):
+        self._entries.append(doc)
+        self._names.append(doc.myName)
+
+    @property
+    def store(self):
+        """the Storage.IndexStore documents not yet loaded are read from (None if there isn't one)"""
+        return self._store
+
+    def remapTerms(self, newID, vocabulary):
+        """moves every document over to compacted vocabulary - newID gives the new ID of each old one. Documents held
+        are remapped now, ones still in the store as they are loaded"""
+        for entry in self._entries:
+            if isinstance(entry, Document):
+                entry.remapTerms(newID, vocabulary)
+
+        self._termMap = newID if self._termMap is None else newID[self._termMap]
+        self._vocabulary = vocabulary
+        # loaded documents are dropped rather than remapped (they are reloaded with the new IDs when next used)
+        self._cache.clear()
+
+    def name(self, docID):
+        """returns name of document docID (None if removed) without loading it"""
+        return self._names[docID]
+
+    def sizes(self, docID):
+        """returns (number of words, number of pages, number of non-zeros) of document docID without loading it"""
+        entry = self._entries[docID]
+        if isinstance(entry, Document):
+            return entry.numWords, entry.numPages, entry.myArray.nnz
+
+        return self._store.documentSizes(entry)
+
+    def isLoaded(self, docID):
+        """True if document docID is in memory (held directly or currently cached)"""
+        entry = self._entries[docID]
+        return isinstance(entry, Document) or entry in self._cache
+
+    def subset(self, docIDs):
+        """returns a new DocumentList of just docIDs (in that order), sharing this one's store and cache"""
+        docs = DocumentList(self._store, self._vocabulary)
+        docs._termMap = self._termMap
+        docs._cache = self._cache
+        docs._entries = [self._entries[docID] for docID in docIDs]
+        docs._names = [self._names[docID] for docID in docIDs]
+
+        return docs
 
 class DocumentCollection:
-    """container for multiple 'Document' objects and wrap around functionality"""
-    def __init__(self, docList):
-        """pass list of Document objects to initialise - will accept a list of one"""
-        self.myDocs = [docList[0]]
+    """container for multiple 'Document' objects and wrap around functionality.
+    myArray - rows are unique words (vocabulary IDs), columns are documents (scipy sparse CSC matrix of raw frequencies).
+    The vocabulary is shared with the documents, which only hold term IDs. Words added to it since the last addDoc
+    (e.g. by a document being built) are beyond the end of myArray's rows until a document holding them is added.
+    Document frequencies and lengths are kept up to date as docs are added/removed; the search index is rebuilt lazily.
+    Documents are ranked by 'scorer' and their pages by 'pageScorer' (see Scoring.py and setScorer).
+    Removed docs are tombstoned (myDocs entry None, column ignored) until enough pile up to compact"""
+
+    # default ranking functions - TF-IDF scaled for document length, pages as Document ranks them
+    scorer = TFIDFScorer()
+    pageScorer = Document.scorer
+
+    # fraction of tombstoned documents at which removeDoc compacts the collection
+    COMPACT_FRACTION = 0.25
+    # fraction of words in no document at which compact also compacts the vocabulary
+    VOCABULARY_COMPACT_FRACTION = 0.25
+    # search results kept - at most this many searches, holding this many (docID/page, score) pairs between them
+    RESULT_CACHE_SIZE = 256
+    RESULT_CACHE_COST = 2 ** 20
+    # documents holding every search word whose positions are read for proximity scoring (the best scoring ones)
+    PROXIMITY_DOCS = 64
+
+    def __init__(self, docList, vocabulary=None):
+        """pass list (or any iterable) of Document objects to initialise - will accept a list of one.
+        vocabulary - 'Vocabulary' the documents were built with (documents with another one are moved over to it)"""
+        self.myDocs = DocumentList()
         #used to provide each unique word an index
-        self.masterDict = {}
+        self.vocabulary = Vocabulary() if vocabulary is None else vocabulary
+        #accumulates document columns with amortised growth (recreated from myArray after unpickling)
+        self._builder = TermMatrixBuilder()
+        self.myArray = self._builder.toCSC()
+        #number of docs each word is in and total words in each doc (buffers - see myDocFreq / myDocLengths)
+        self._docFreq = np.zeros((1024,), dtype=np.int64)
+        self._docLengths = np.zeros((64,))
+        #False for tombstoned (removed) documents (buffer - see myLive)
+        self._live = np.zeros((64,), dtype=bool)
+        self.numRemoved = 0
+        #page weighted frequency of each word in each doc, for scorers using pages (see scoreCounts)
+        self._pageCounts = None
+        #recent search results for the current generation (see _changed)
+        self.generation = 0
+        self._results = LRUCache(self.RESULT_CACHE_SIZE, self.RESULT_CACHE_COST)
+        self._changed()
+
+        for doc in docList:
+            self.addDoc(doc)
+
+        # make sure the search index is initialised once all docs are in
+        self.updateTFIDArray()
 
-        #requests dict from doc in form {uniqueWord1 : total freq, uniqueWord2 : total freq...}
-        tempDict = docList[0].getWordFreqTotalPairs()
-        tempFreqList = []
+    @classmethod
+    def fromBagsOfWords(cls, docBags):
+        """builds a collection in a single pass from an iterable of (docName, [page BoW dict, ...]) pairs,
+        e.g. the contents of the 'Processed' _BoW files"""
+        vocabulary = Vocabulary()
+        return cls((Document.fromPages(docName, pages, vocabulary) for docName, pages in docBags), vocabulary)
+
+    @classmethod
+    def fromStore(cls, store, cacheSize=32):
+        """opens a collection from a Storage.IndexStore. The collection matrix and postings stay memory mapped (read
+        only - the matrix is copied into memory by the first addDoc) and documents are only loaded when used, at most
+        cacheSize at a time"""
+        collection = cls.__new__(cls)
+
+        collection.vocabulary = Vocabulary.fromBlob(*store.vocabBlob())
+        collection._builder = None
+        collection.myArray = store.docMatrix()
+        collection._docFreq = np.array(store.segment("doc_freq"))
+        collection._docLengths = np.array(store.segment("doc_lengths"))
+        collection._live = np.ones(len(store.docNames), dtype=bool)
+        collection.numRemoved = 0
+        collection._pageCounts = None
+        collection.generation = 0
+        collection._results = LRUCache(cls.RESULT_CACHE_SIZE, cls.RESULT_CACHE_COST)
+        collection._changed()
+
+        collection.myDocs = DocumentList.fromStore(store, collection.vocabulary, cacheSize)
+
+        # the saved postings are searched in place (memory mapped) if they are in the scorer's impact order
+        scorer = collection.scorer
+        index = store.postingsIndex(scorer, scorer.idf(len(collection), collection.myDocFreq),
+                                    scorer.norms(collection.myDocLengths, collection.myLive))
+        if index is not None:
+            collection._index = index
+            collection._TFIDFStale = False
+
+        return collection
+
+    def __getstate__(self):
+        # the builder's spare capacity is not worth pickling - it is rebuilt from myArray on the next addDoc
+        state = self.__dict__.copy()
+        state["_builder"] = None
+        state["_similarity"] = None
+        state["_index"] = None
+        state["_pageCounts"] = None
+        state["_TFIDFStale"] = True
+        state["_results"] = LRUCache(self.RESULT_CACHE_SIZE, self.RESULT_CACHE_COST)
+        state["_docFreq"] = self.myDocFreq.copy()
+        state["_docLengths"] = self.myDocLengths.copy()
+        state["_live"] = self.myLive.copy()
+        return state
+
+    def __len__(self):
+        """number of documents in the collection (not counting removed ones)"""
+        return len(self.myDocs) - self.numRemoved
+
+    @property
+    def masterDict(self):
+        """the vocabulary - reads like the {word : row} dict this used to be"""
+        return self.vocabulary
+
+    @property
+    def myDocFreq(self):
+        """number of documents each word appears in (indexed as the rows of myArray)"""
+        return self._docFreq[:self.myArray.shape[0]]
+
+    @property
+    def myDocLengths(self):
+        """total number of words in each document (indexed as myDocs)"""
+        return self._docLengths[:len(self.myDocs)]
+
+    @property
+    def myLive(self):
+        """True for each document still in the collection, False where removed (indexed as myDocs)"""
+        return self._live[:len(self.myDocs)]
+
+    @property
+    def scoreCounts(self):
+        """words x docs frequencies the scorer works from - myArray, or for a scorer using pages (BM25F) each doc's
+        page weighted frequencies, worked out from every document's pages on first use then kept up to date by addDoc"""
+        if not self.scorer.usesPages:
+            return self.myArray
+
+        if self._pageCounts is None:
+            self._pageCounts = TermMatrixBuilder(self.myArray.shape[0])
+            for docID in range(len(self.myDocs)):
+                self._addPageCounts(self.myDocs[docID] if self.myLive[docID] else None)
+
+        self._pageCounts.numRows = self.myArray.shape[0]
+        return self._pageCounts.toCSC()
+
+    def _addPageCounts(self, doc):
+        """appends doc's column to the page weighted frequencies (an empty one for a removed doc)"""
+        if doc is None:
+            self._pageCounts.addColumn([], [])
+        else:
+            self._pageCounts.addColumn(doc.myTermIDs, self.scorer.termFrequencies(doc.myArray))
+
+    @property
+    def similarity(self):
+        """SimilarityEngine over the raw document vectors - rebuilt on first use after the collection changes"""
+        if self._similarity is None:
+            self._similarity = SimilarityEngine(self.myArray, self.myLive)
+
+        return self._similarity
+
+    def _changed(self):
+        """marks everything derived from myArray as out of date (recomputed lazily on next use)"""
+        self._TFIDFStale = True
+        self._similarity = None
+        self._newGeneration()
+
+    def _newGeneration(self):
+        """search results from before this point may be wrong - drop them all"""
+        self.generation += 1
+        self._results.clear()
+
+    @property
+    def resultCacheStats(self):
+        """dictionary of search result cache counters - hits, misses, entries held and current generation"""
+        return {"hits": self._results.hits, "misses": self._results.misses, "entries": len(self._results),
+                "generation": self.generation}
+
+    @property
+    def index(self):
+        """InvertedIndex of the documents (impact ordered postings, scored by scorer) - rebuilt here if docs have been
+        added or removed since it was built"""
+        if self._TFIDFStale:
+            self.updateTFIDArray()
 
-        for word in tempDict:
-            self.masterDict[word] = len(self.masterDict)
-            tempFreqList.append(tempDict[word])
+        return self._index
 
-        self.myArray = np.array([tempFreqList],dtype=np.float_).T
+    def addDoc(self, doc, updateTFID = False):
+        """pass 'Document' object. Only the doc's own words have their document frequency touched - the TFID Array
+        is recomputed lazily on next search unless updateTFID is True. Returns the new docID"""
+        self.myDocs.append(doc)
 
-        for doc in docList[1:]:
-            self.addDoc(doc, updateTFID=False)
+        # the doc's rows are already vocabulary IDs once it shares the collection's vocabulary
+        doc.useVocabulary(self.vocabulary)
+        rows, freqs = doc.getTermFreqArrays()
 
-        # make sure the TFID Array is initialised for first doc entry
-        self.updateTFIDArray()
+        if self._builder is None:
+            self._builder = TermMatrixBuilder.fromMatrix(self.myArray)
 
-    def addDoc(self, doc, updateTFID = True):
-        """pass 'Document' object"""
-        self.myDocs.append(doc)
+        self._builder.addColumn(rows, freqs, len(self.vocabulary))
+        self.myArray = self._builder.toCSC()
 
-        # requests dict from doc in form {uniqueWord1 : total freq, uniqueWord2 : total freq...}
-        tempDict = doc.getWordFreqTotalPairs()
-        tempList = []
-        for i in range(len(self.masterDict)):
-            tempList.append([0])
-        self.myArray = np.append(self.myArray, tempList, axis=1)
-        for word in tempDict:
-            if word in self.masterDict:
-                self.myArray[self.masterDict[word],len(self.myDocs)-1] = tempDict[word]
-            else:
-                #add additional row at bottom for new word with updated element at far right
-                tempList2 = []
-                for i in range(len(self.myDocs)-1):
-                    tempList2.append(0)
-                #add the new word's frequency for the new doc
-                tempList2.append(tempDict[word])
-                self.myArray = np.append(self.myArray, [tempList2], axis=0)
-
-                #update self.myWordsDict to include new word (with indexing)
-                self.masterDict[word] = len(self.masterDict)
-
-        #make sure the TFID Array is updated for new doc
+        # keep document frequencies and lengths current (rows are unique within a doc)
+        self._docFreq = growArray(self._docFreq, len(self.vocabulary))
+        self._docLengths = growArray(self._docLengths, len(self.myDocs))
+        self._live = growArray(self._live, len(self.myDocs))
+        self._docFreq[rows] += freqs != 0
+        self._docLengths[len(self.myDocs) - 1] = np.sum(freqs)
+        self._live[len(self.myDocs) - 1] = True
+        if self._pageCounts is not None:
+            self._addPageCounts(doc)
+
+        self._changed()
         if updateTFID:
             self.updateTFIDArray()
 
-    def updateTFIDArray(self):
-        # adjusted raw freq array used for conducting searches
-        self.TFIDFArray = self.myArray.copy()
+        return len(self.myDocs) - 1
 
-        columnSum = np.sum(self.TFIDFArray,axis = 0)
+    def setScorer(self, scorer=None, pageScorer=None):
+        """ranks documents by scorer and pages by pageScorer (see Scoring.py) from now on - None leaves one as it is.
+        Impact order depends on the scorer, so a new scorer means the index is built again (sorting every posting) on
+        the next search - as is a page index on its document's next page search"""
+        if scorer is not None and scorer is not self.scorer:
+            self.scorer = scorer
+            self._pageCounts = None
+            self._changed()
 
-        for x in range(len(columnSum)):
-            self.TFIDFArray[:,x] /= columnSum[x]
+        if pageScorer is not None and pageScorer is not self.pageScorer:
+            self.pageScorer = pageScorer
+            self._newGeneration()
 
-        rows = (np.count_nonzero(self.TFIDFArray, axis = 1))
+    def updateTFIDArray(self):
+        """works out the scorer's word and document arrays and rebuilds the index over the raw frequencies (named
+        from when this built a TF-IDF matrix). Removed documents score 0 so are left out of the postings"""
+        scorer = self.scorer
+        self._index = InvertedIndex(self.scoreCounts, scorer, scorer.idf(len(self), self.myDocFreq),
+                                    scorer.norms(self.myDocLengths, self.myLive))
+        self._TFIDFStale = False
+        self._newGeneration()
+
+    def search(self, listWords, k=None, window=None):
+        """returns sorted list (highest match first) of tuples (docID, search match score).
+        With k, only the top k documents containing at least one search word are returned (read from the inverted
+        index without scoring the whole library); without k every document is ranked.
+        window - documents with the words as a phrase or within window words of each other score higher (see
+        proximityRerank)"""
+        addLog("Search conducted", listWords, logging.DEBUG)
+
+        # scores don't depend on word order (unless phrases count), so neither does the key
+        key = ("docs", tuple(sorted(listWords)), k) if window is None else ("docs", tuple(listWords), k, window)
+        cached = self._results.get(key)
+        if cached is not None:
+            return list(cached)
+
+        sortedRow = self._rankDocs(listWords, k, window)
+        self._results.put(key, tuple(sortedRow), len(sortedRow))
 
-        for x in range(len(rows)):
-            self.TFIDFArray[x,:] *= math.log(len(columnSum)/rows[x])
+        return sortedRow
 
-    def search(self,listWords):
-        """returns sorted list (highest match first) of tuples (docID, search match score)"""
-        addLog("Search conducted", str(listWords))
+    def searchWithPages(self, listWords, k, m=1, window=None):
+        """returns list of (docID, score, ((page, page score), ...)) - the top k documents for listWords (as
+        search(listWords, k, window)), each with its m best pages (as Document.topPages), highest first.
+        One call (and one result cache entry) for a whole list of results - pages are picked by partial selection over
+        just the search words' page postings, and with a window the positions read to rank the documents are used to
+        rank their pages"""
+        addLog("Search with pages conducted", listWords, logging.DEBUG)
+
+        key = ("docsPages", tuple(sorted(listWords)), k, m) if window is None else \
+            ("docsPages", tuple(listWords), k, m, window)
+        cached = self._results.get(key)
+        if cached is not None:
+            return list(cached)
+
+        # documents share the vocabulary, so the words are looked up once for all of them
+        termIDs = self.vocabulary.idsOf(listWords)
+        pageBonuses = {} if window is not None else None
+        results = []
+        for docID, score in self._rankDocs(listWords, k, window, pageBonuses, termIDs):
+            doc = self.myDocs[docID]
+            doc.setScorer(self.pageScorer)
+            proximity = pageBonuses.get(docID) if pageBonuses else None
+            results.append((docID, score, tuple(doc.topPages(listWords, m, window, proximity, termIDs))))
+
+        self._results.put(key, tuple(results), len(results) * (1 + m))
+
+        return results
+
+    def _rankDocs(self, listWords, k, window, pageBonuses=None, termIDs=None):
+        """search without the result cache - see search and proximityRerank for pageBonuses"""
+        if termIDs is None:
+            termIDs = self.vocabulary.idsOf(listWords)
+        found = (termIDs >= 0) & (termIDs < self.myArray.shape[0])
+        for i in np.flatnonzero(~found).tolist():
+            addLog("Search Word not found", listWords[i], logging.DEBUG)
+
+        wordRows = termIDs[found].tolist()
+
+        if k is not None:
+            docIDs, scores = self.index.topK(wordRows, k)
+            sortedRow = list(zip(docIDs.tolist(), scores.tolist()))
 
-        row = np.zeros((len(self.myDocs),))
-        for word in listWords:
+        else:
+            row = self.index.scores(wordRows)
 
-            if word in self.masterDict:
-                row += self.TFIDFArray[self.masterDict[word]]
-            else:
-                addLog("Search Word not found", word)
+            sortedRow = []
 
-        sortedRow = []
+            for i,v in enumerate(row):
+                #sortedRow.append((self.myDocs[i],v))
+                if self.myLive[i]:
+                    sortedRow.append((i,v))
 
-        for i,v in enumerate(row):
-            #sortedRow.append((self.myDocs[i],v))
-            sortedRow.append((i,v))
+            sortedRow = sorted(sortedRow, key=lambda i: i[1], reverse=True)
+
+        if window is not None:
+            sortedRow = self.proximityRerank(listWords, wordRows, sortedRow, k, window, pageBonuses)
 
-        sortedRow = sorted(sortedRow, key=lambda i: i[1], reverse=True)
+        return sortedRow
+
+    def proximityRerank(self, listWords, wordRows, sortedRow, k, window, pageBonuses=None):
+        """returns sortedRow (search results for listWords, whose rows are wordRows) with the documents holding the
+        words as a phrase or within window words scored up by their best page's bonus (see Document.proximity), cut
+        to k. A postings intersection finds the documents holding every word first - positions are only read for the
+        best PROXIMITY_DOCS of them.
+        pageBonuses - optional dict filled with {docID : (pages, bonuses)} of every document whose positions were read"""
+        rows = list(dict.fromkeys(wordRows))
+        if len(rows) < 2 or len(rows) < len(set(listWords)):
+            return sortedRow
+
+        # intersected on the counts rather than the scoring postings - a word in every document scores 0 (and has
+        # no postings) but still makes a phrase
+        candidates = self.index.docsOf(rows[0])
+        for row in rows[1:]:
+            candidates = np.intersect1d(candidates, self.index.docsOf(row), assume_unique=True)
+        candidates = candidates[self.myLive[candidates]]
+
+        scores = np.zeros(len(candidates))
+        for row in wordRows:
+            scores += self.index.weightsFor(row, candidates)
+
+        # only scoring documents are ranked - when every word is in every document they all score 0
+        candidates = candidates[scores > 0]
+        scores = scores[scores > 0]
+        best = np.argsort(-scores, kind="stable")[:self.PROXIMITY_DOCS]
+
+        results = dict(sortedRow)
+        for docID, score in zip(candidates[best].tolist(), scores[best].tolist()):
+            pages, bonuses = self.myDocs[docID].proximity(listWords, window)
+            if pageBonuses is not None:
+                pageBonuses[docID] = (pages, bonuses)
+            if len(bonuses):
+                results[docID] = float(score * (1 + bonuses.max()))
+
+        # highest score first, ties by docID
+        sortedRow = sorted(results.items(), key=lambda i: (-i[1], i[0]))
+        return sortedRow if k is None else sortedRow[:k]
+
+    def wordRows(self, listWords):
+        """returns list of the rows (vocabulary IDs) of listWords, repeats kept - words in no document are left out"""
+        termIDs = self.vocabulary.idsOf(listWords)
+        return termIDs[(termIDs >= 0) & (termIDs < self.myArray.shape[0])].tolist()
+
+    def searchBatch(self, listOfQueries, k=None):
+        """searches several pre-processed word lists at once - all queries are scored in one sparse matrix product
+        with the scores of just their words. Returns a list holding, for each query, what search(listWords, k) would"""
+        addLog("Batch search conducted", len(listOfQueries), logging.DEBUG)
+
+        queries = [self.wordRows(listWords) for listWords in listOfQueries]
+        queryRows = [row for query in queries for row in query]
+        scores = queryMatrix(queries, self.myArray.shape[0]) @ self.index.rowWeights(queryRows)
+
+        if k is not None:
+            # only documents containing a search word have a stored score, as with the inverted index
+            return [list(zip(docIDs.tolist(), values.tolist())) for docIDs, values in topKPerRow(scores.tocsr(), k)]
+
+        # every live document ranked, highest first (ties by docID)
+        liveIDs = np.flatnonzero(self.myLive)
+        results = []
+        for query in range(scores.shape[0]):
+            row = scores[query].toarray().ravel()[liveIDs]
+            order = np.lexsort((liveIDs, -row))
+            results.append(list(zip(liveIDs[order].tolist(), row[order].tolist())))
+
+        return results
+
+    def searchPagesBatch(self, docID, listOfQueries, k=None):
+        """Document.searchBatch of document docID - page rankings of several queries at once"""
+        doc = self.myDocs[docID]
+        doc.setScorer(self.pageScorer)
+        return doc.searchBatch(listOfQueries, k)
+
+    def searchPages(self, docID, listWords, window=None):
+        """returns Document.search of document docID (pages sorted lowest match first), cached like search"""
+        key = ("pages", docID, tuple(sorted(listWords))) if window is None else \
+            ("pages", docID, tuple(listWords), window)
+        cached = self._results.get(key)
+        if cached is not None:
+            return list(cached)
+
+        doc = self.myDocs[docID]
+        doc.setScorer(self.pageScorer)
+        sortedRow = doc.search(listWords, window)
+        self._results.put(key, tuple(sortedRow), len(sortedRow))
 
         return sortedRow
 
+    def findDoc(self, docName):
+        """returns docID (position in myDocs) of the document called docName, None if not in the collection"""
+        for docID in range(len(self.myDocs)):
+            if self.myDocs.name(docID) == docName:
+                return docID
+
+        return None
+
+    def removeDoc(self, docID, compact=True):
+        """removes document docID from the collection. Its column is tombstoned (myDocs entry set to None) and the
+        document frequency of its words reduced - no other docIDs change until the collection is compacted, which
+        happens here once more than COMPACT_FRACTION of the docs are tombstones (unless compact is False)"""
+        if not self.myLive[docID]:
+            return
+
+        column = self.myArray[:, docID]
+        self._docFreq[column.indices] -= 1
+        self._live[docID] = False
+        self.myDocs[docID] = None
+        self.numRemoved += 1
+
+        self._changed()
+
+        if compact and self.numRemoved > self.COMPACT_FRACTION * len(self.myDocs):
+            self.compact()
+
+    def replaceDoc(self, docID, doc, compact=True):
+        """replaces document docID with 'Document' object doc. Returns the replacement's docID (the old one becomes a
+        tombstone, see removeDoc)"""
+        newDocID = self.addDoc(doc)
+        self.removeDoc(docID, compact=False)
+
+        if compact and self.numRemoved > self.COMPACT_FRACTION * len(self.myDocs):
+            self.compact()
+            return self.findDoc(doc.myName)
+
+        return newDocID
+
+    def compact(self):
+        """drops tombstoned document columns - docIDs of the remaining documents close up to fill the gaps.
+        Words no longer in any document keep their vocabulary ID with a document frequency of 0 (and are left out when
+        the collection is saved, see Storage) until more than VOCABULARY_COMPACT_FRACTION of the words are like that,
+        then the vocabulary is compacted too"""
+        liveDocs = np.flatnonzero(self.myLive)
+        matrix = self.myArray[:, liveDocs]
+
+        self._docLengths = self.myDocLengths[liveDocs]
+        if self._pageCounts is not None:
+            self._pageCounts = TermMatrixBuilder.fromMatrix(self.scoreCounts[:, liveDocs])
+        self.myDocs = self.myDocs.subset(liveDocs)
+        self._live = np.ones(len(liveDocs), dtype=bool)
+        self.numRemoved = 0
+
+        self._builder = TermMatrixBuilder.fromMatrix(matrix)
+        self.myArray = self._builder.toCSC()
+        self._changed()
+
+        if np.count_nonzero(self.myDocFreq == 0) > self.VOCABULARY_COMPACT_FRACTION * len(self.vocabulary):
+            self.compactVocabulary()
+
+    def compactVocabulary(self):
+        """drops words no longer in any document from the vocabulary and the rows of myArray - the remaining words are
+        given new IDs (in the same order). The collection and its documents move to a new 'Vocabulary', so documents
+        built with the old one but not yet added keep working (addDoc moves them over). Words added to the vocabulary
+        beyond the rows of myArray (by documents being built) are kept"""
+        numRows = self.myArray.shape[0]
+        keep = np.ones(len(self.vocabulary), dtype=bool)
+        keep[:numRows] = self.myDocFreq > 0
+        keptIDs = np.flatnonzero(keep)
+        keptRows = keptIDs[keptIDs < numRows]
+
+        newID = np.full(len(keep), -1, dtype=np.int64)
+        newID[keptIDs] = np.arange(len(keptIDs))
+
+        if self._pageCounts is not None:
+            self._pageCounts = TermMatrixBuilder.fromMatrix(self.scoreCounts[keptRows])
+
+        self.vocabulary = Vocabulary.fromBlob(*self.vocabulary.packed(keptIDs))
+        self._docFreq = self.myDocFreq[keptRows]
+        self._builder = TermMatrixBuilder.fromMatrix(self.myArray[keptRows])
+        self.myArray = self._builder.toCSC()
+        self.myDocs.remapTerms(newID, self.vocabulary)
+        self._changed()
+
     def returnDocVector(self, docID):
-        """returns documents vector as set against 'masterDict;.
+        """returns documents vector as set against the vocabulary.
         docID is for identifying from this objects 'myDocs' list"""
 
-        array = self.myArray[:, docID]
+        array = self.myArray[:, docID].toarray().ravel()
         array = array / np.sum(array)
 
         return array
@@ -478,26 +1421,22 @@ class DocumentCollection:
         array1 = self.myArray[:, docID1]
         array2 = self.myArray[:, docID2]
 
-        cosine_sim = np.dot(array1, array2) / (np.linalg.norm(array1) * np.linalg.norm(array2))
+        # only the non-zero entries of each column take part (.data holds them for a CSC column)
+        cosine_sim = array1.multiply(array2).sum() / (np.linalg.norm(array1.data) * np.linalg.norm(array2.data))
 
         return cosine_sim
 
-    def getSimilarList(self,docID):
-        """returns a list of docIDs (position in myDocs) from closest similarity to least"""
-
-        myList = []
-
-        #run through each document in library and calculate cosine similarity with passed docID
-        for i in range(len(self.myDocs)):
-            myList.append((i, self.docCosineSim(docID, i)))
-
-        #delete the passed docID as it is clearly 100% similar to itself
-        del myList[docID]
+    def getSimilarList(self, docID, k=None):
+        """returns a list of (docID (position in myDocs), cosine similarity) tuples from closest similarity to least -
+        just the k closest if k is given. The passed docID (clearly 100% similar to itself) and removed docs are left out"""
+        docIDs, scores = self.similarity.similar(docID, k)
 
-        #sort list so most similar appears first
-        myList.sort(key=lambda i: i[1], reverse=True)
+        return list(zip(docIDs.tolist(), scores.tolist()))
 
-        return myList
+    def precomputeSimilar(self, k=5, memoryBudget=256 * 2 ** 20):
+        """works out the k most similar documents of every document in one go (blocked so at most about memoryBudget
+        bytes are in use) - getSimilarList calls for up to k are then answered from the table"""
+        self.similarity.allPairs(k, memoryBudget)
 
     def pickleToFile(self, path):
 
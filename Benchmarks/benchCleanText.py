@@ -0,0 +1,81 @@
+"""Checks Ingest.cleanText gives byte-identical output to the original one re.sub per step version, over the fixture
+pages in Benchmarks/fixtures and a synthetic corpus, and times the two.
+
+    python Benchmarks/benchCleanText.py [number of synthetic pages]"""
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import Ingest
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def referenceCleanText(text):
+    """cleanText as it was before its patterns were combined and precompiled"""
+    text = re.sub(r'\n: \'\'.*', '', text)
+    text = re.sub(r'\n!.*', '', text)
+    text = re.sub(r'^:\'\'.*', '', text)
+    text = re.sub(r'\n', ' ', text)
+    text = re.sub(",", "", text)
+    text = re.sub(r"[\([{})\]]", " ", text)
+    text = re.sub(' +', ' ', text)
+
+    return text
+
+
+def fixturePages():
+    """returns list of the fixture pages' text"""
+    pages = []
+    for name in sorted(os.listdir(FIXTURES)):
+        if name.endswith(".txt"):
+            with open(os.path.join(FIXTURES, name), "r", encoding="utf-8", newline="") as f:
+                pages.append(f.read())
+
+    return pages
+
+
+def syntheticPages(numPages, seed=1):
+    """returns numPages of page-sized text mixing ordinary words with everything cleanText handles"""
+    rng = random.Random(seed)
+    pieces = ["passenger", "aircraft", "737ng", "1,204", "(see", "figure)", "[note]", "{x}", "don't", ",", "  ", "\n",
+              "\n: ''ref", "\n!note", ":''", "\n\n", " ", "\t", "café", "\r\n"]
+    weights = [30, 30, 5, 5, 3, 3, 3, 1, 3, 5, 5, 8, 1, 1, 1, 2, 40, 1, 1, 1]
+
+    return ["".join(rng.choices(pieces, weights, k=1500)) for i in range(numPages)]
+
+
+def timeIt(function, pages, repeats=3):
+    """best of repeats time (seconds) to run function over every page"""
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        for page in pages:
+            function(page)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    numPages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    pages = fixturePages() + syntheticPages(numPages)
+
+    mismatches = [i for i, page in enumerate(pages) if Ingest.cleanText(page) != referenceCleanText(page)]
+    if mismatches:
+        print("cleanText output differs from the reference on", len(mismatches), "pages, e.g. page", mismatches[0])
+        sys.exit(1)
+    print("cleanText output identical to the reference on", len(pages), "pages")
+
+    reference = timeIt(referenceCleanText, pages)
+    current = timeIt(Ingest.cleanText, pages)
+    print("reference: %.4f s   cleanText: %.4f s   speed up: %.2fx" % (reference, current, reference / current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Reproducible timings of the library index on a synthetic corpus - no spaCy model or PDFs needed.
+
+Page bags of words are drawn from a Zipf distribution over a made up vocabulary (seeded, so the same arguments always
+give the same corpus). Times DocumentCollection construction, updateTFIDArray, search (top k and full ranking, documents
+ranked by --scorer), searchWithPages, Document.search, getSimilarList and pickle save / load, plus the peak memory
+(tracemalloc) of building the collection.
+Results are printed and, with --output, written as JSON for tracking between versions.
+
+    python Benchmarks/benchLibrary.py --docs 500 --pages 40 --vocab 50000 --output results.json"""
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import log
+from Alexandria import DocumentCollection
+from Scoring import TFIDFScorer, BM25Scorer, BM25FScorer
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "su", "ra", "to", "vi", "pe", "da", "ze", "gu", "bo", "fi", "ha", "ju", "ly", "wo",
+             "sy", "qu", "an", "er", "in", "ol", "us", "ax"]
+
+SCORERS = {"tfidf": TFIDFScorer, "bm25": BM25Scorer, "bm25f": BM25FScorer}
+
+
+def syntheticWords(vocabSize):
+    """returns vocabSize distinct made up words (a few syllables each, so lengths vary like real ones)"""
+    words = []
+    for i in range(vocabSize):
+        word = ""
+        i += len(SYLLABLES)
+        while i:
+            i, syllable = divmod(i, len(SYLLABLES))
+            word += SYLLABLES[syllable]
+        words.append(word)
+
+    return words
+
+
+def syntheticCorpus(numDocs, pagesPerDoc, wordsPerPage, vocabSize, zipfExponent=1.1, seed=1):
+    """returns list of (docName, [page BoW dict, ...]) like the 'Processed' _BoW files.
+    Documents have 1 to 2 * pagesPerDoc pages and pages about wordsPerPage words (Poisson), each word picked with
+    probability proportional to 1 / rank ** zipfExponent"""
+    rng = np.random.default_rng(seed)
+    words = np.array(syntheticWords(vocabSize), dtype=object)
+    weights = 1.0 / np.arange(1, vocabSize + 1) ** zipfExponent
+    weights /= weights.sum()
+
+    corpus = []
+    for docID in range(numDocs):
+        numPages = int(rng.integers(1, 2 * pagesPerDoc + 1))
+        lengths = rng.poisson(wordsPerPage, numPages)
+        ranks = rng.choice(vocabSize, size=int(lengths.sum()), p=weights)
+
+        pages = []
+        start = 0
+        for length in lengths:
+            pageRanks, counts = np.unique(ranks[start:start + length], return_counts=True)
+            pages.append(dict(zip(words[pageRanks].tolist(), counts.tolist())))
+            start += length
+
+        corpus.append(("doc%06d" % docID, pages))
+
+    return corpus
+
+
+def syntheticQueries(numQueries, vocabSize, zipfExponent=1.1, seed=2):
+    """returns numQueries lists of 1 to 3 words, picked like the corpus words but skipping the very commonest ones
+    (as stop words are skipped in real queries)"""
+    rng = np.random.default_rng(seed)
+    words = syntheticWords(vocabSize)
+    skip = min(20, vocabSize - 1)
+    weights = 1.0 / np.arange(skip + 1, vocabSize + 1) ** zipfExponent
+    weights /= weights.sum()
+
+    return [[words[skip + rank] for rank in rng.choice(vocabSize - skip, size=int(rng.integers(1, 4)), p=weights)]
+            for i in range(numQueries)]
+
+
+def timeIt(function, repeats=3):
+    """best of repeats time (seconds) to run function, and what its last run returned"""
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def peakMemory(function):
+    """peak bytes allocated through Python (tracemalloc) while function runs - run apart from the timings as tracing
+    slows everything down"""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def runBenchmarks(corpus, queries, repeats=3, tempDir=None, scorer=None):
+    """returns {benchmark name : {"seconds" : best time, ...}} for the library built from corpus, ranking documents
+    with scorer (the collection's default if None)"""
+    results = {}
+
+    seconds, library = timeIt(lambda: DocumentCollection.fromBagsOfWords(corpus), repeats)
+    library.setScorer(scorer)
+    results["build"] = {"seconds": seconds, "docs": len(library), "words": len(library.vocabulary),
+                        "nnz": int(library.myArray.nnz)}
+    results["build"]["peakBytes"] = peakMemory(lambda: DocumentCollection.fromBagsOfWords(corpus))
+
+    seconds, _ = timeIt(library.updateTFIDArray, repeats)
+    results["updateTFIDArray"] = {"seconds": seconds}
+
+    def searchAll(k):
+        # search results are cached - a new generation starts each run cold
+        library._newGeneration()
+        for listWords in queries:
+            library.search(listWords, k)
+
+    for name, k in (("searchTop10", 10), ("searchAll", None)):
+        seconds, _ = timeIt(lambda: searchAll(k), repeats)
+        results[name] = {"seconds": seconds, "queries": len(queries), "perQuery": seconds / len(queries)}
+
+    def searchWithPages():
+        library._newGeneration()
+        for listWords in queries:
+            library.searchWithPages(listWords, 10, 1)
+
+    seconds, _ = timeIt(searchWithPages, repeats)
+    results["searchWithPages"] = {"seconds": seconds, "queries": len(queries), "perQuery": seconds / len(queries)}
+
+    docs = [library.myDocs[docID] for docID in range(0, len(library.myDocs), max(1, len(library.myDocs) // 50))]
+
+    def searchDocs():
+        for doc in docs:
+            for listWords in queries[:20]:
+                doc.search(listWords)
+
+    seconds, _ = timeIt(searchDocs, repeats)
+    numSearches = len(docs) * len(queries[:20])
+    results["documentSearch"] = {"seconds": seconds, "searches": numSearches, "perSearch": seconds / numSearches}
+
+    def similarAll():
+        # the similarity engine is rebuilt from scratch each run
+        library._similarity = None
+        for doc in range(0, len(library.myDocs), max(1, len(library.myDocs) // 50)):
+            library.getSimilarList(doc, 5)
+
+    seconds, _ = timeIt(similarAll, repeats)
+    results["getSimilarList"] = {"seconds": seconds}
+
+    path = os.path.join(tempDir or tempfile.gettempdir(), "benchLibrary.pickle")
+    seconds, _ = timeIt(lambda: library.pickleToFile(path), repeats)
+    results["pickleSave"] = {"seconds": seconds, "bytes": os.path.getsize(path)}
+
+    def pickleLoad():
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    seconds, _ = timeIt(pickleLoad, repeats)
+    results["pickleLoad"] = {"seconds": seconds}
+    os.remove(path)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Alexandria library index benchmarks on a synthetic corpus")
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=30, help="average pages per document")
+    parser.add_argument("--words", type=int, default=250, help="average words per page")
+    parser.add_argument("--vocab", type=int, default=30000, help="vocabulary size")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of the word distribution")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scorer", choices=sorted(SCORERS), default="tfidf", help="document ranking function")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    # search events are logged at DEBUG - kept out of the timings (and out of the real LogFile)
+    log.setupLogging(eventFile=os.path.join(tempfile.gettempdir(), "benchLibrary.log"), appFile=None,
+                     eventLevel=logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        start = time.perf_counter()
+        corpus = syntheticCorpus(args.docs, args.pages, args.words, args.vocab, args.zipf, args.seed)
+        queries = syntheticQueries(args.queries, args.vocab, args.zipf, args.seed + 1)
+        print("Corpus of", args.docs, "documents,", sum(len(pages) for name, pages in corpus), "pages generated in",
+              round(time.perf_counter() - start, 2), "s")
+
+        results = runBenchmarks(corpus, queries, args.repeats, tempDir, SCORERS[args.scorer]())
+
+    for name, result in results.items():
+        details = ", ".join("%s %s" % (key, round(value, 6) if isinstance(value, float) else value)
+                            for key, value in result.items() if key != "seconds")
+        print("  %-16s %10.4f s   %s" % (name, result["seconds"], details))
+
+    if args.output:
+        report = {"config": vars(args), "results": results,
+                  "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                                  "scipy": scipy.__version__, "platform": platform.platform()},
+                  "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Results written to", args.output)
+
+
+if __name__ == '__main__':
+    main()
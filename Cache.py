@@ -0,0 +1,60 @@
+"""Small caching helpers shared across Alexandria"""
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """dict-like cache holding at most maxSize entries - the least recently used entry is dropped first.
+    maxCost - optional limit on the total cost of the entries (each put gives a cost, e.g. its length).
+    hits / misses count lookups through get"""
+    def __init__(self, maxSize, maxCost=None):
+        self.maxSize = maxSize
+        self.maxCost = maxCost
+        self._entries = OrderedDict()
+        self._costs = {}
+        self.totalCost = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """returns cached value for key (marking it most recently used) or default if not cached"""
+        if key not in self._entries:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value, cost=1):
+        """caches value under key (an entry costing more than maxCost on its own isn't kept)"""
+        self.pop(key)
+        if self.maxCost is not None and cost > self.maxCost:
+            return
+
+        self._entries[key] = value
+        self._costs[key] = cost
+        self.totalCost += cost
+
+        while len(self._entries) > self.maxSize or (self.maxCost is not None and self.totalCost > self.maxCost):
+            oldKey = self._entries.popitem(last=False)[0]
+            self.totalCost -= self._costs.pop(oldKey)
+
+    def pop(self, key, default=None):
+        if key not in self._entries:
+            return default
+
+        self.totalCost -= self._costs.pop(key)
+        return self._entries.pop(key)
+
+    def clear(self):
+        """drops every entry (the hit / miss counts are kept)"""
+        self._entries.clear()
+        self._costs.clear()
+        self.totalCost = 0
@@ -0,0 +1,260 @@
+"""Contains index building blocks shared by 'Document' and 'DocumentCollection' (Alexandria.py)"""
+
+import itertools
+import numpy as np
+from scipy import sparse
+
+
+class TermMatrixBuilder:
+    """Accumulates a sparse words x columns matrix (CSC layout) one column at a time.
+    Buffers grow by doubling so adding columns is amortised linear in the number of non-zeros"""
+    def __init__(self, numRows=0, capacity=1024, columnCapacity=64):
+        self.numRows = numRows
+        self.numCols = 0
+        self.nnz = 0
+
+        self._indices = np.empty(capacity, dtype=np.int32)
+        self._data = np.empty(capacity, dtype=np.float64)
+        self._indptr = np.zeros(columnCapacity + 1, dtype=np.int32)
+
+    @classmethod
+    def fromMatrix(cls, matrix):
+        """returns a builder pre-filled with the columns of an existing sparse matrix"""
+        matrix = sparse.csc_matrix(matrix)
+        matrix.sum_duplicates()
+
+        builder = cls(matrix.shape[0], capacity=max(2 * matrix.nnz, 1024), columnCapacity=max(2 * matrix.shape[1], 64))
+        builder.numCols = matrix.shape[1]
+        builder.nnz = matrix.nnz
+        builder._indices[:matrix.nnz] = matrix.indices
+        builder._data[:matrix.nnz] = matrix.data
+        builder._indptr[:matrix.shape[1] + 1] = matrix.indptr
+
+        return builder
+
+    def addColumn(self, rows, values, numRows=None):
+        """appends a column with non-zero 'values' at (unique) 'rows'. numRows grows the matrix for new words"""
+        rows = np.asarray(rows, dtype=np.int32)
+        values = np.asarray(values, dtype=np.float64)
+
+        # zero frequencies are not stored and rows are kept sorted within each column (canonical CSC)
+        keep = values != 0
+        rows = rows[keep]
+        values = values[keep]
+        order = np.argsort(rows, kind="stable")
+
+        if numRows is not None:
+            self.numRows = max(self.numRows, numRows)
+
+        end = self.nnz + len(rows)
+        if end > len(self._data):
+            newCapacity = max(end, 2 * len(self._data))
+            self._indices = np.resize(self._indices, newCapacity)
+            self._data = np.resize(self._data, newCapacity)
+
+        if self.numCols + 2 > len(self._indptr):
+            self._indptr = np.resize(self._indptr, 2 * len(self._indptr))
+
+        self._indices[self.nnz:end] = rows[order]
+        self._data[self.nnz:end] = values[order]
+        self.nnz = end
+        self.numCols += 1
+        self._indptr[self.numCols] = end
+
+    def toCSC(self):
+        """returns the accumulated matrix as CSC (views onto the buffers, no copy)"""
+        return sparse.csc_matrix((self._data[:self.nnz], self._indices[:self.nnz], self._indptr[:self.numCols + 1]),
+                                 shape=(self.numRows, self.numCols), copy=False)
+
+
+def growArray(array, size):
+    """returns 'array' with room for at least 'size' entries - capacity doubles (zero filled) when full"""
+    if size <= len(array):
+        return array
+
+    grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+
+    return grown
+
+
+def queryMatrix(queries, numRows):
+    """returns CSR queries x words matrix from a list of queries, each a list of word rows - entries count how often
+    each row is in the query, so queryMatrix @ weights sums the weights the same way as a single search"""
+    indptr = np.zeros(len(queries) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(rows) for rows in queries])
+    indices = np.fromiter(itertools.chain.from_iterable(queries), dtype=np.int64, count=int(indptr[-1]))
+
+    matrix = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(queries), numRows))
+    matrix.sum_duplicates()
+
+    return matrix
+
+
+def topKPerRow(matrix, k=None):
+    """returns list of (columns, values) of each row's k highest stored values in CSR 'matrix', highest first (ties by
+    column) - every stored value if k is None. Partial selection keeps each row linear in its number of entries"""
+    results = []
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        columns = matrix.indices[start:end]
+        values = matrix.data[start:end]
+
+        if k is not None and k < len(values):
+            # everything tied with the k-th value stays in so ties are broken by column below
+            kth = -np.partition(-values, k - 1)[k - 1]
+            keep = values >= kth
+            columns = columns[keep]
+            values = values[keep]
+
+        order = np.lexsort((columns, -values))[:k]
+        results.append((columns[order].astype(np.int64), values[order]))
+
+    return results
+
+
+class InvertedIndex:
+    """word -> postings (docIDs, raw counts) sorted by impact (highest score first), built from a CSR words x docs
+    counts matrix and scored at query time by 'scorer' (Scoring.py) from the counts and its per word 'idf' and per doc
+    'norms' arrays - no weighted copy of the matrix is kept. Postings scoring 0 (removed docs, words in every doc) are
+    left out. topK stops reading postings as soon as no unread document can make the top k"""
+    def __init__(self, counts, scorer, idf, norms):
+        counts = sparse.csr_matrix(counts)
+        counts.sort_indices()
+        self.numDocs = counts.shape[1]
+        self.scorer = scorer
+        self.idf = idf
+        self.norms = norms
+
+        # docID ordered rows are kept (shared, not copied) for random access to a word's count in a doc
+        self._byDoc = counts
+
+        # impact order - each row sorted by descending score (ties by docID), scoring postings first
+        rowOfEntry = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        weights = scorer.weights(counts.data, idf[rowOfEntry], norms[counts.indices])
+        order = np.lexsort((counts.indices, -weights, rowOfEntry))
+        self.indptr = counts.indptr
+        self.postingDocs = counts.indices[order]
+        self.postingCounts = counts.data[order]
+        self.ends = self.indptr[:-1] + np.bincount(rowOfEntry[weights > 0], minlength=counts.shape[0])
+
+    @classmethod
+    def fromPostings(cls, byDoc, postingDocs, postingCounts, ends, scorer, idf, norms):
+        """returns an index over postings already in impact order for scorer (e.g. memory mapped from a saved
+        index, see Storage) - byDoc is the CSR words x docs counts matrix (indices sorted), postingDocs, postingCounts
+        and ends as the attributes of an index built from it. Nothing is sorted or copied"""
+        index = cls.__new__(cls)
+        index.numDocs = byDoc.shape[1]
+        index.scorer = scorer
+        index.idf = idf
+        index.norms = norms
+
+        index._byDoc = byDoc
+        index.indptr = byDoc.indptr
+        index.postingDocs = postingDocs
+        index.postingCounts = postingCounts
+        index.ends = ends
+
+        return index
+
+    @property
+    def counts(self):
+        """the CSR words x docs counts matrix the index was built from (docID ordered rows)"""
+        return self._byDoc
+
+    def numPostings(self, row):
+        return self.ends[row] - self.indptr[row]
+
+    def postings(self, row, depth=None):
+        """returns (docIDs, scores) for word 'row' in impact order - just the first depth of them if given"""
+        start, end = self.indptr[row], self.ends[row]
+        if depth is not None:
+            end = min(end, start + depth)
+
+        docs = self.postingDocs[start:end]
+        return docs, self.scorer.weights(self.postingCounts[start:end], self.idf[row], self.norms[docs])
+
+    def docsOf(self, row):
+        """returns ascending docIDs of every doc holding word 'row' - postings scoring 0 included"""
+        return self._byDoc.indices[self._byDoc.indptr[row]:self._byDoc.indptr[row + 1]]
+
+    def weightsFor(self, row, docs):
+        """returns score of word 'row' in each of 'docs' (0 where the word is not in the doc)"""
+        start, end = self._byDoc.indptr[row], self._byDoc.indptr[row + 1]
+        rowDocs = self._byDoc.indices[start:end]
+
+        if len(rowDocs) == 0:
+            return np.zeros(len(docs))
+
+        pos = np.minimum(np.searchsorted(rowDocs, docs), len(rowDocs) - 1)
+        found = rowDocs[pos] == docs
+        weights = np.zeros(len(docs))
+        weights[found] = self.scorer.weights(self._byDoc.data[start + pos[found]], self.idf[row],
+                                             self.norms[docs[found]])
+        return weights
+
+    def scores(self, rows):
+        """returns dense array of every doc's summed score for word 'rows' (repeated rows count each time)"""
+        scores = np.zeros(self.numDocs)
+        for row in np.asarray(rows, dtype=np.int64).tolist():
+            docs, weights = self.postings(row)
+            scores[docs] += weights
+
+        return scores
+
+    def rowWeights(self, rows):
+        """returns CSR words x docs matrix of the scores of word 'rows' (other rows empty) - for batches of searches
+        summed through queryMatrix(...) @ rowWeights(...)"""
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        lists = [self.postings(row) for row in rows.tolist()]
+
+        indptr = np.zeros(len(self.indptr), dtype=np.int64)
+        indptr[rows + 1] = [len(docs) for docs, weights in lists]
+        indptr = np.cumsum(indptr)
+        indices = np.concatenate([docs for docs, weights in lists] + [np.zeros(0, dtype=np.int32)])
+        data = np.concatenate([weights for docs, weights in lists] + [np.zeros(0)])
+
+        return sparse.csr_matrix((data, indices, indptr), shape=self._byDoc.shape)
+
+    def topK(self, rows, k):
+        """returns (docIDs, scores) of the k highest scoring docs for the summed scores of word 'rows'
+        (repeated rows count each time), best first. Only docs scoring for at least one of the words are returned.
+        Postings are read in impact order with doubling depth (scoring just what is read) until the k-th best exact
+        score reaches the highest score any unread document could still have (threshold algorithm)"""
+        rows, repeats = np.unique(np.asarray(rows, dtype=np.int64), return_counts=True)
+        lists = [(row, repeat, self.numPostings(row)) for row, repeat in zip(rows.tolist(), repeats.tolist())]
+        lists = [entry for entry in lists if entry[2] > 0]
+
+        if k <= 0 or not lists:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        # a single word's postings are already in rank order
+        if len(lists) == 1:
+            row, repeat, numPostings = lists[0]
+            docs, weights = self.postings(row, k)
+            return docs.astype(np.int64), weights * repeat
+
+        depth = k
+        while True:
+            candidates = np.unique(np.concatenate([self.postings(row, depth)[0] for row, repeat, n in lists]))
+            scores = np.zeros(len(candidates))
+            for row, repeat, numPostings in lists:
+                scores += repeat * self.weightsFor(row, candidates)
+
+            # best possible score of a doc not yet seen in any list - the score of each list's next posting
+            bound = 0.0
+            for row, repeat, numPostings in lists:
+                if depth < numPostings:
+                    start = self.indptr[row] + depth
+                    bound += repeat * self.scorer.weights(self.postingCounts[start], self.idf[row],
+                                                          self.norms[self.postingDocs[start]])
+            exhausted = all(depth >= numPostings for row, repeat, numPostings in lists)
+
+            if exhausted or (len(candidates) >= k and np.partition(scores, -k)[-k] >= bound):
+                break
+
+            depth *= 2
+
+        # highest score first, ties by docID
+        order = np.lexsort((candidates, -scores))[:k]
+        return candidates[order].astype(np.int64), scores[order]
@@ -0,0 +1,373 @@
+"""PDF ingestion pipeline for 'Alexandria.processDocs' - page extraction and text cleaning, run either in-process
+or fanned out across worker processes feeding a bounded queue, streaming one page at a time. Also the _BoW files
+the pages end up in - JSON lines written as they arrive (so an interrupted document can be resumed), compacted to the
+binary _BoW.bin format once the document is finished"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import struct
+import zlib
+import numpy as np
+from scipy import sparse
+
+# page numbers used as end of document markers in the (docName, pageNo) context passed along with page text
+PAGES_DONE = -1
+PAGES_FAILED = -2
+
+# first line of a _BoW.jsonl file - [BOW_FORMAT, BOW_VERSION, source pdf stamp] (page lines are JSON objects)
+BOW_FORMAT = "alexandria-bow"
+BOW_VERSION = 1
+
+# _BoW file endings in order of preference when a document has more than one
+BOW_SUFFIXES = ("_BoW.bin", "_BoW.jsonl", "_BoW.json")
+
+# optional page positions file written alongside - same layout as a _BoW.jsonl file, with a {word : [positions]}
+# object per page (see Positions)
+POS_SUFFIX = "_Pos.jsonl"
+
+# _BoW.bin layout (little endian) - header: magic, version, flags, number of terms, pages and (termID, count) pairs,
+# then the body (zlib compressed if flags has BIN_ZLIB): term offsets uint32[terms + 1], page starts uint32[pages + 1],
+# termIDs uint32[pairs], counts uint32[pairs], utf-8 terms back to back. Each term is stored once per document and
+# each page's pairs are sorted by termID, so the arrays are a ready made CSC terms x pages matrix
+BIN_HEADER = struct.Struct("<4sHHIIQ")
+BIN_MAGIC = b"ABoW"
+BIN_VERSION = 1
+BIN_ZLIB = 1
+
+
+# cleanText patterns, compiled once:
+# unwanted lines starting from special characters (": ''" or "!")
+UNWANTED_LINES = re.compile(r"\n(?:: ''|!)[^\n]*")
+# non-breaking new line characters and brackets become spaces (brackets confuse the NLP processor - might have to
+# consider this in future for acronym handling), commas are removed (they provide no added benefit and confuse
+# processing of large numbers). str.replace rather than one regex or translate table - both are several times slower
+# on text that isn't pure ASCII
+CHARACTER_REPLACEMENTS = (("\n", " "), (",", ""), ("(", " "), ("[", " "), ("{", " "), ("}", " "), (")", " "),
+                          ("]", " "))
+# runs of spaces become a single space
+EXTRA_SPACES = re.compile("  +")
+
+
+def cleanText(text):
+    """takes text and cleans it by:
+    -removing unwanted lines
+    -removing commas
+    -removing brackets (need to consider this carefully in future for acronyms)
+    -additional spaces
+    Output is identical to the original one re.sub per step version (see Benchmarks/benchCleanText.py)"""
+
+    # single quotes are kept as removing them leads to "didn't" becoming "didnt" which confuses spacy/nlp, as are
+    # digits and punctuation. Not lowercased either, to preserve original text for Acronym handling later
+    text = UNWANTED_LINES.sub("", text)
+
+    # a first line starting ":''" is unwanted too
+    if text.startswith(":''"):
+        newLine = text.find("\n")
+        text = text[newLine:] if newLine >= 0 else ""
+
+    for old, new in CHARACTER_REPLACEMENTS:
+        text = text.replace(old, new)
+
+    return EXTRA_SPACES.sub(" ", text)
+
+
+def iterPDFPages(pdfPath, startPage=0):
+    """yields (cleaned page text, (docName, pageNo)) for each page of the pdf from startPage on, then
+    ("", (docName, PAGES_DONE)). If the pdf can't be read the last item is ("", (docName, PAGES_FAILED)) instead"""
+    # only needed when there are pdfs to read (it is slow to import)
+    import pdfplumber
+
+    docName = os.path.basename(pdfPath)[:-4]
+
+    try:
+        with pdfplumber.open(pdfPath) as pdf:
+            for pageNo in range(startPage, len(pdf.pages)):
+                page = pdf.pages[pageNo]
+
+                # pages with no text layer (e.g. scanned images) come back as None
+                text = page.extract_text() or ""
+
+                # otherwise pdfplumber holds on to every page's parsed objects until the file is closed
+                page.flush_cache()
+
+                yield cleanText(text), (docName, pageNo)
+
+    except Exception as e:
+        print("In function 'iterPDFPages' - could not read", pdfPath, ":", e)
+        yield "", (docName, PAGES_FAILED)
+        return
+
+    yield "", (docName, PAGES_DONE)
+
+
+def extractWorker(taskQueue, pageQueue):
+    """worker process - takes (pdf path, start page) tasks from taskQueue until None and puts their pages onto
+    pageQueue. Puts None when finished"""
+    try:
+        for pdfPath, startPage in iter(taskQueue.get, None):
+            for item in iterPDFPages(pdfPath, startPage):
+                pageQueue.put(item)
+    finally:
+        pageQueue.put(None)
+
+
+def iterPages(pdfPaths, workers=1, queueSize=256, startPages=None):
+    """yields (cleaned page text, (docName, pageNo)) for every page of every pdf, each doc followed by its
+    PAGES_DONE / PAGES_FAILED marker. With workers > 1 extraction runs in that many processes; pages come back
+    through a queue holding at most queueSize pages so memory stays flat however large the corpus is.
+    Pages of one doc stay in order but docs can interleave.
+    startPages - optional {pdfPath : first page to extract} for resuming part processed pdfs"""
+    startPages = startPages or {}
+
+    if workers <= 1:
+        for pdfPath in pdfPaths:
+            yield from iterPDFPages(pdfPath, startPages.get(pdfPath, 0))
+        return
+
+    taskQueue = multiprocessing.Queue()
+    pageQueue = multiprocessing.Queue(maxsize=queueSize)
+
+    for pdfPath in pdfPaths:
+        taskQueue.put((pdfPath, startPages.get(pdfPath, 0)))
+    for i in range(workers):
+        taskQueue.put(None)
+
+    processes = [multiprocessing.Process(target=extractWorker, args=(taskQueue, pageQueue), daemon=True)
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+
+    try:
+        finished = 0
+        while finished < workers:
+            item = pageQueue.get()
+            if item is None:
+                finished += 1
+            else:
+                yield item
+
+    finally:
+        # only still running if the consumer stopped early
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+
+def sourceStamp(pdfPath):
+    """identifies the version of a pdf a _BoW file was made from - [name, size, mtime]"""
+    stat = os.stat(pdfPath)
+    return [os.path.basename(pdfPath), stat.st_size, stat.st_mtime]
+
+
+def resumeBoW(path, pdfPath):
+    """returns the number of pages already in path's .part file, left by an interrupted run on the same (unchanged)
+    pdf, cutting off any half written last line. Returns 0 (removing the .part) if there is nothing to resume"""
+    partPath = path + ".part"
+    if not os.path.exists(partPath):
+        return 0
+
+    with open(partPath, "rb+") as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            header = None
+
+        if header == [BOW_FORMAT, BOW_VERSION, sourceStamp(pdfPath)]:
+            pages = 0
+            end = f.tell()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                pages += 1
+                end += len(line)
+
+            f.truncate(end)
+            return pages
+
+    os.remove(partPath)
+    return 0
+
+
+class BoWWriter:
+    """writes a document's page BoW dicts for path, one JSON line per page as they arrive (after a header line naming
+    the source pdf) to path + ".part". close puts the finished file in place at path - the lines as they are for a
+    _BoW.jsonl path, compacted for a _BoW.bin path (see writeBinaryBoW).
+    resume - append to the .part left by an interrupted run (see resumeBoW) rather than starting again"""
+    def __init__(self, path, pdfPath, resume=False, compress=True):
+        self.path = path
+        self.partPath = path + ".part"
+        self.compress = compress
+
+        if resume and os.path.exists(self.partPath):
+            self._file = open(self.partPath, "a")
+        else:
+            self._file = open(self.partPath, "w")
+            self._file.write(json.dumps([BOW_FORMAT, BOW_VERSION, sourceStamp(pdfPath)]) + "\n")
+
+    def writePage(self, BoWDict):
+        self._file.write(json.dumps(BoWDict) + "\n")
+
+    def close(self):
+        """finishes the file - only moved into place when complete, so a _BoW file never has pages missing"""
+        self._file.close()
+
+        if self.path.endswith(".bin"):
+            writeBinaryBoW(self.path + ".tmp", readBoW(self.partPath), self.compress)
+            os.replace(self.path + ".tmp", self.path)
+            os.remove(self.partPath)
+        else:
+            os.replace(self.partPath, self.path)
+
+    def abandon(self):
+        """closes and deletes the .part file (e.g. the pdf turned out to be unreadable)"""
+        self._file.close()
+        os.remove(self.partPath)
+
+
+def readBoW(path):
+    """yields the page BoW dicts of a _BoW.jsonl file one at a time"""
+    with open(path, "r") as f:
+        # header line
+        f.readline()
+
+        for line in f:
+            yield json.loads(line)
+
+
+def writeBinaryBoW(path, pages, compress=True):
+    """writes an iterable of page BoW dicts as a _BoW.bin file (layout above). compress - zlib the body"""
+    termIDs = {}
+    rows = []
+    counts = []
+    pageStarts = [0]
+
+    for BoWDict in pages:
+        # zero counts aren't stored, and pairs are sorted by termID within each page
+        pairs = sorted((termIDs.setdefault(word, len(termIDs)), count) for word, count in BoWDict.items() if count)
+        rows.extend(row for row, count in pairs)
+        counts.extend(count for row, count in pairs)
+        pageStarts.append(len(rows))
+
+    encoded = [word.encode("utf-8") for word in termIDs]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(word) for word in encoded])
+
+    body = b"".join((offsets.tobytes(), np.asarray(pageStarts, dtype="<u4").tobytes(),
+                     np.asarray(rows, dtype="<u4").tobytes(), np.asarray(counts, dtype="<u4").tobytes(),
+                     b"".join(encoded)))
+
+    with open(path, "wb") as f:
+        f.write(BIN_HEADER.pack(BIN_MAGIC, BIN_VERSION, BIN_ZLIB if compress else 0, len(encoded),
+                                len(pageStarts) - 1, len(rows)))
+        f.write(zlib.compress(body) if compress else body)
+
+
+def readBinaryBoW(path):
+    """returns (list of terms, page matrix - scipy CSC terms x pages of counts) from a _BoW.bin file, read straight
+    into arrays (no per page dicts), ready for Document.fromArrays"""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, flags, numTerms, numPages, numPairs = BIN_HEADER.unpack_from(data)
+    if magic != BIN_MAGIC:
+        raise ValueError("'" + path + "' is not a binary _BoW file")
+    if version != BIN_VERSION:
+        raise ValueError("binary _BoW version " + str(version) + " not supported")
+
+    body = zlib.decompress(data[BIN_HEADER.size:]) if flags & BIN_ZLIB else data[BIN_HEADER.size:]
+
+    sections = []
+    start = 0
+    for length in (numTerms + 1, numPages + 1, numPairs, numPairs):
+        sections.append(np.frombuffer(body, dtype="<u4", count=length, offset=start))
+        start += 4 * length
+    offsets, pageStarts, rows, counts = sections
+
+    blob = body[start:]
+    offsets = offsets.tolist()
+    terms = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(numTerms)]
+
+    pages = sparse.csc_matrix((counts.astype(np.float64), rows.astype(np.int32), pageStarts.astype(np.int32)),
+                              shape=(numTerms, numPages))
+
+    return terms, pages
+
+
+def iterBinaryBoW(path):
+    """yields the page BoW dicts of a _BoW.bin file (for code still wanting dicts - see readBinaryBoW)"""
+    terms, pages = readBinaryBoW(path)
+    for page in range(pages.shape[1]):
+        start, end = pages.indptr[page], pages.indptr[page + 1]
+        yield {terms[row]: int(count) for row, count in zip(pages.indices[start:end], pages.data[start:end])}
+
+
+def fileHash(path):
+    """returns sha256 hex digest of the file's contents (read in 1MB chunks)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class Manifest:
+    """record of the source files behind the 'Processed' folder, saved as JSON in the form
+    {fileName : {"size" : bytes, "mtime" : seconds, "hash" : sha256}} so a sync only reprocesses what changed"""
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.files = json.load(f)
+
+    def save(self):
+        # written to a temporary file first so a crash never leaves a half written manifest
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.files, f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+    def changes(self, sourceDir, extension=".pdf"):
+        """compares sourceDir with the manifest and returns (added, changed, deleted) lists of file names.
+        Files whose size and mtime match are assumed unchanged; otherwise the content hash decides, so a file
+        that was only touched just has its entry refreshed. Entries for new/changed files are left to 'record'"""
+        added = []
+        changed = []
+        present = set()
+
+        with os.scandir(sourceDir) as items:
+            for item in items:
+                if not item.name.endswith(extension):
+                    continue
+
+                present.add(item.name)
+                stat = item.stat()
+                entry = self.files.get(item.name)
+
+                if entry is None:
+                    added.append(item.name)
+
+                elif entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+                    if fileHash(item.path) == entry["hash"]:
+                        entry["size"] = stat.st_size
+                        entry["mtime"] = stat.st_mtime
+                    else:
+                        changed.append(item.name)
+
+        deleted = [name for name in self.files if name not in present]
+
+        return sorted(added), sorted(changed), sorted(deleted)
+
+    def record(self, filePath):
+        """adds/refreshes the entry for filePath (after it has been processed)"""
+        stat = os.stat(filePath)
+        self.files[os.path.basename(filePath)] = {"size": stat.st_size, "mtime": stat.st_mtime,
+                                                  "hash": fileHash(filePath)}
+
+    def remove(self, fileName):
+        self.files.pop(fileName, None)
@@ -0,0 +1,98 @@
+"""Deferred spaCy model loading - lets the library be opened and searched while the (slow to load) model is still on
+its way, see 'ModelLoader' and 'QueryLookup'"""
+
+import json
+import os
+import threading
+import time
+
+
+class ModelLoader:
+    """loads spaCy model modelName on a background thread (spacy itself is only imported there).
+    Pass to Alexandria in place of a model - it waits on get() the first time the model is actually needed"""
+    def __init__(self, modelName, background=True):
+        self.modelName = modelName
+        self.loadTime = None
+        self._model = None
+        self._error = None
+        self._thread = threading.Thread(target=self._load, name="spacy.load", daemon=True)
+
+        if background:
+            self._thread.start()
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            import spacy
+            self._model = spacy.load(self.modelName)
+        except Exception as e:
+            self._error = e
+        self.loadTime = time.perf_counter() - start
+
+    @property
+    def ready(self):
+        """True once the model has finished loading (or failed to)"""
+        return self.loadTime is not None
+
+    def get(self):
+        """returns the model - loading it here if not started in the background, otherwise waiting for it to finish"""
+        if self._thread.is_alive():
+            self._thread.join()
+        elif not self.ready:
+            self._load()
+
+        if self._error is not None:
+            raise self._error
+
+        return self._model
+
+
+class QueryLookup:
+    """{lower case token : search words} table for answering simple queries without the spaCy model.
+    Filled from the model's stop words and from every token the model processes for a query (see
+    Alexandria.processInput), and saved between runs. A query is only answered from the table if each of its
+    whitespace separated pieces is a token the model has seen whole - lemmas are taken as the model last gave them,
+    ignoring context, so the table is for use until the model is ready rather than in place of it"""
+    def __init__(self, tokens=None):
+        self.tokens = {} if tokens is None else tokens
+
+    @classmethod
+    def fromModel(cls, nlp):
+        """table holding the stop words of model nlp (they give no search words)"""
+        return cls({word.lower(): () for word in nlp.Defaults.stop_words})
+
+    @classmethod
+    def load(cls, path):
+        """table saved at path, an empty one if there isn't one"""
+        if not os.path.exists(path):
+            return cls()
+
+        with open(path, "r", encoding="utf-8") as f:
+            return cls({token: tuple(words) for token, words in json.load(f).items()})
+
+    def save(self, path):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({token: list(words) for token, words in self.tokens.items()}, f)
+        os.replace(path + ".tmp", path)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def add(self, token, words):
+        """records the search words (a list, empty if the token is skipped) the model gave for token (lower case)"""
+        self.tokens[token] = tuple(words)
+
+    def searchWords(self, text):
+        """returns list of search words for text as the model would give them, None if any piece of it is unknown"""
+        searchWords = []
+        for piece in text.lower().split():
+            # tokens of 2 characters or less are always skipped
+            if len(piece) <= 2:
+                continue
+
+            words = self.tokens.get(piece)
+            if words is None:
+                return None
+            searchWords += words
+
+        return searchWords
@@ -0,0 +1,179 @@
+"""Page level positional index - where each word of a 'Document' appears on each page, for phrase and proximity
+scoring of multi word searches (see Document.proximity and DocumentCollection.search).
+
+A position is the word's number among the words kept on the page (stop words and short tokens are not counted, see
+Alexandria.NLPcreateBagOfWords), so the words of a query are next to each other when the text only has stop words
+between them. Positions are stored delta + varint encoded (7 bits a byte, high bit set on all but the last byte of
+each value)"""
+
+import numpy as np
+
+# score multiplier bonuses - a page holding the query words as a phrase (in query order, next to each other) scores
+# (1 + PHRASE_BONUS) x its search score, one holding them all within the window up to (1 + WINDOW_BONUS) x
+PHRASE_BONUS = 1.0
+WINDOW_BONUS = 0.5
+
+
+def encodeVarints(values):
+    """returns (bytes of non-negative int64 values varint encoded back to back, number of bytes of each value)"""
+    values = np.asarray(values, dtype=np.int64)
+    numBytes = np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28, 35, 42, 49, 56):
+        numBytes += values >= (1 << bits)
+
+    # byte k of a value holds bits 7k to 7k + 6
+    starts = np.cumsum(numBytes) - numBytes
+    k = np.arange(int(numBytes.sum())) - np.repeat(starts, numBytes)
+    encoded = (np.repeat(values, numBytes) >> (7 * k)) & 0x7F
+    encoded[k < np.repeat(numBytes, numBytes) - 1] |= 0x80
+
+    return encoded.astype(np.uint8).tobytes(), numBytes
+
+
+def decodeVarints(data):
+    """returns int64 array of the values in varint encoded uint8 array data"""
+    data = np.asarray(data, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.int64)
+
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    k = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+
+    return np.add.reduceat((data & 0x7F).astype(np.int64) << (7 * k), starts)
+
+
+class PositionalIndex:
+    """word row -> page -> positions of one document. Entries are grouped by row (CSR like) - entries
+    rowPtr[row] to rowPtr[row + 1] are the pages the word is on (ascending, entryPages) and the positions on each are
+    bytes offsets[entry] to offsets[entry + 1] of blob (ascending, delta encoded from 0 for each entry)"""
+    def __init__(self, rowPtr, entryPages, offsets, blob):
+        self.rowPtr = rowPtr
+        self.entryPages = entryPages
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def fromPages(cls, pagePositions, rowsOf, numRows):
+        """builds the index from an iterable of page {word : [positions]} dicts (in page order).
+        rowsOf - function returning the document rows of a list of words (-1 for words not in the document, which
+        are left out)"""
+        entryRows = []
+        entryPages = []
+        counts = []
+        positions = []
+        for page, words in enumerate(pagePositions):
+            rows = rowsOf(list(words)).tolist()
+            for row, wordPositions in zip(rows, words.values()):
+                if row >= 0 and wordPositions:
+                    entryRows.append(row)
+                    entryPages.append(page)
+                    counts.append(len(wordPositions))
+                    positions += wordPositions
+
+        entryRows = np.array(entryRows, dtype=np.int64)
+        entryPages = np.array(entryPages, dtype=np.int64)
+        counts = np.array(counts, dtype=np.int64)
+        positions = np.array(positions, dtype=np.int64)
+
+        # entries into row then page order, taking their positions with them
+        order = np.lexsort((entryPages, entryRows))
+        oldStarts = np.cumsum(counts) - counts
+        counts = counts[order]
+        starts = np.cumsum(counts) - counts
+        positions = positions[np.repeat(oldStarts[order] - starts, counts) + np.arange(len(positions))]
+
+        deltas = positions.copy()
+        deltas[1:] -= positions[:-1]
+        deltas[starts] = positions[starts]
+        blob, numBytes = encodeVarints(deltas)
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        if len(counts):
+            offsets[1:] = np.cumsum(np.add.reduceat(numBytes, starts))
+
+        rowPtr = np.zeros(numRows + 1, dtype=np.int64)
+        rowPtr[1:] = np.cumsum(np.bincount(entryRows, minlength=numRows))
+
+        return cls(rowPtr, entryPages[order], offsets, np.frombuffer(blob, dtype=np.uint8))
+
+    @property
+    def numRows(self):
+        return len(self.rowPtr) - 1
+
+    def pagesOf(self, row):
+        """returns array of the pages word 'row' is on"""
+        return self.entryPages[self.rowPtr[row]:self.rowPtr[row + 1]]
+
+    def positions(self, row, page):
+        """returns int64 array of the positions of word 'row' on page (empty if it isn't there)"""
+        start, end = self.rowPtr[row], self.rowPtr[row + 1]
+        entry = start + np.searchsorted(self.entryPages[start:end], page)
+        if entry >= end or self.entryPages[entry] != page:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.cumsum(decodeVarints(self.blob[self.offsets[entry]:self.offsets[entry + 1]]))
+
+    def candidatePages(self, rows):
+        """returns array of the pages holding every one of word 'rows' - positions are only read for these"""
+        pages = self.pagesOf(rows[0])
+        for row in rows[1:]:
+            pages = np.intersect1d(pages, self.pagesOf(row), assume_unique=True)
+
+        return pages
+
+    def proximity(self, rows, window):
+        """returns (pages, bonuses) - the score bonus of each page holding all of word 'rows' (in query order, no
+        repeats) as a phrase (PHRASE_BONUS) or within window words of each other (less the further apart they are)"""
+        if len(rows) < 2 or any(row < 0 or row >= self.numRows for row in rows):
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        pages = self.candidatePages(rows)
+        bonuses = np.zeros(len(pages))
+        for i, page in enumerate(pages.tolist()):
+            lists = [self.positions(row, page) for row in rows]
+
+            # phrase - a start position from which word i is i words on, for every word
+            starts = lists[0]
+            for offset, wordPositions in enumerate(lists[1:], 1):
+                starts = np.intersect1d(starts, wordPositions - offset, assume_unique=True)
+            if len(starts):
+                bonuses[i] = PHRASE_BONUS
+                continue
+
+            # words in between beyond the ones that have to be (0 if they are next to each other in some order)
+            slack = minimumSpan(lists) - (len(rows) - 1)
+            if slack < window:
+                bonuses[i] = WINDOW_BONUS * (1 - slack / window)
+
+        return pages, bonuses
+
+
+def minimumSpan(lists):
+    """returns the shortest distance from first to last of a stretch holding a position from every one of lists
+    (each ascending)"""
+    positions = np.concatenate(lists)
+    owners = np.repeat(np.arange(len(lists)), [len(wordPositions) for wordPositions in lists])
+    order = np.argsort(positions, kind="stable")
+    positions = positions[order].tolist()
+    owners = owners[order].tolist()
+
+    # sliding window over the merged positions, shrunk from the left whenever it holds every list
+    best = None
+    held = [0] * len(lists)
+    numHeld = 0
+    left = 0
+    for right, owner in enumerate(owners):
+        if held[owner] == 0:
+            numHeld += 1
+        held[owner] += 1
+
+        while numHeld == len(lists):
+            span = positions[right] - positions[left]
+            best = span if best is None else min(best, span)
+            held[owners[left]] -= 1
+            if held[owners[left]] == 0:
+                numHeld -= 1
+            left += 1
+
+    return best
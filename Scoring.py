@@ -0,0 +1,124 @@
+"""Ranking functions ('scorers') for DocumentCollection and Document searches.
+
+Scores are worked out at query time from the raw counts - whenever the counts change a scorer works out a per word
+array (idf) and a per column array (norms - columns are documents for a collection, pages for a document) once, then
+weights() turns the counts of one word in some columns into their scores. So no weighted copy of the counts matrix is
+kept, but postings are sorted by score (see Index.InvertedIndex) - switching ranking function sorts them again.
+Every scorer must give a score of 0 in columns that aren't live (removed documents)"""
+
+import numpy as np
+
+
+def inverseFrequency(total, counts):
+    """returns log(total / count) for each count (0 where a count is 0, i.e. word no longer present)"""
+    idf = np.zeros(len(counts))
+    present = counts > 0
+    idf[present] = np.log(total / counts[present])
+
+    return idf
+
+
+class Scorer:
+    """base scorer - subclasses give idf, norms and weights"""
+
+    # True if the scorer works from each document's page weighted frequencies (see termFrequencies) rather than its
+    # plain word totals
+    usesPages = False
+
+    def idf(self, numColumns, columnFreq):
+        """returns per word array from the number of (live) columns and the number of columns each word is in"""
+        raise NotImplementedError
+
+    def norms(self, lengths, live):
+        """returns per column array from each column's length (total count) and whether it is live"""
+        raise NotImplementedError
+
+    def weights(self, counts, idf, norms):
+        """returns scores of counts - idf and norms are the entries of idf() and norms() for each count (or one word's
+        idf for all of them)"""
+        raise NotImplementedError
+
+    def termFrequencies(self, pages):
+        """returns the frequency of each word (row) of a document from its page matrix (CSC, words x pages) - only
+        used by scorers with usesPages"""
+        return np.asarray(pages.sum(axis=1)).ravel()
+
+    def __repr__(self):
+        return type(self).__name__ + "(" + ", ".join("%s=%r" % item for item in vars(self).items()) + ")"
+
+
+class TFIDFScorer(Scorer):
+    """count x log(number of columns / columns holding the word), divided by the column's length if lengthNorm (as
+    collection searches always have been - page searches have been without it)"""
+    def __init__(self, lengthNorm=True):
+        self.lengthNorm = lengthNorm
+
+    def idf(self, numColumns, columnFreq):
+        return inverseFrequency(numColumns, columnFreq)
+
+    def norms(self, lengths, live):
+        # empty and removed columns score 0 rather than dividing by zero
+        if self.lengthNorm:
+            return np.divide(1.0, lengths, out=np.zeros(len(lengths)), where=(lengths > 0) & live)
+
+        return live.astype(np.float64)
+
+    def weights(self, counts, idf, norms):
+        return counts * idf * norms
+
+
+class BM25Scorer(Scorer):
+    """Okapi BM25 - idf x count x (k1 + 1) / (count + k1 x (1 - b + b x length / average length)).
+    The part after 'count +' is the column's norm, infinite for removed columns so they score 0"""
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    def idf(self, numColumns, columnFreq):
+        idf = np.log(1 + (numColumns - columnFreq + 0.5) / (columnFreq + 0.5))
+        idf[columnFreq <= 0] = 0
+
+        return idf
+
+    def norms(self, lengths, live):
+        liveLengths = lengths[live]
+        average = liveLengths.mean() if len(liveLengths) and liveLengths.mean() > 0 else 1.0
+
+        norms = np.full(len(lengths), np.inf)
+        norms[live] = self.k1 * (1 - self.b + self.b * liveLengths / average)
+
+        return norms
+
+    def weights(self, counts, idf, norms):
+        return idf * counts * (self.k1 + 1) / (counts + norms)
+
+
+class BM25FScorer(BM25Scorer):
+    """BM25F with each page of a document a field - a word's frequency in a document is the sum of its counts on
+    each page x the page's weight, each page normalised for its length by pageB against the average page length of
+    its own document (not of the whole collection). The first firstPages pages (title, summary, contents) weigh
+    firstPageWeight, the rest 1. As the pages are already normalised, frequencies are then saturated by plain k1 (no
+    document length normalisation - b is unused)"""
+    usesPages = True
+
+    def __init__(self, k1=1.2, pageB=0.75, firstPages=1, firstPageWeight=2.0):
+        super().__init__(k1, 0.0)
+        self.pageB = pageB
+        self.firstPages = firstPages
+        self.firstPageWeight = firstPageWeight
+
+    def norms(self, lengths, live):
+        norms = np.full(len(lengths), np.inf)
+        norms[live] = self.k1
+
+        return norms
+
+    def pageWeights(self, numPages):
+        """returns the weight of each page of a document with numPages pages"""
+        return np.where(np.arange(numPages) < self.firstPages, self.firstPageWeight, 1.0)
+
+    def termFrequencies(self, pages):
+        lengths = np.asarray(pages.sum(axis=0)).ravel()
+        average = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+
+        return pages @ (self.pageWeights(len(lengths)) / (1 - self.pageB + self.pageB * lengths / average))
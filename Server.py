@@ -0,0 +1,302 @@
+"""Headless query service - a small asyncio HTTP/JSON server over a saved library index (see Storage), for use
+without the GUI in main.py.
+
+The index is opened once and shared read only by every request; searches run on the event loop (they only read the
+index) while spaCy query processing, the CPU heavy part, runs in a pool of worker processes each holding its own
+model. All responses are JSON:
+    GET /search?q=<text>&k=<n>&pages=1  - top k documents (each with its best page when pages=1)
+    GET /pages?doc=<docID>&q=<text>&k=<n> - top k pages of one document
+    GET /similar?doc=<docID>&k=<n>      - the k documents most similar to docID
+    GET /stats                           - library size and search result cache counters
+
+    python Server.py --index library_index --port 8080
+    python Server.py --load-test --port 8080 --requests 2000 --concurrency 32"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import random
+import time
+import urllib.parse
+
+import log
+from Alexandria import Alexandria
+
+# each worker process's own Alexandria (model only, no library) - see initWorker
+_worker = None
+
+
+def initWorker(modelName, logQueue):
+    """runs once in each worker process - loads the spaCy model and sends log lines to the server's log sink"""
+    global _worker
+    import spacy
+
+    log.forwardLogging(logQueue)
+    _worker = Alexandria(spacy.load(modelName))
+
+
+def processQuery(text):
+    """runs in a worker process - returns the lemmatised search words of text (see Alexandria.processInput)"""
+    return _worker.processInput(text)
+
+
+class RequestError(Exception):
+    """bad request - status is the HTTP status code to reply with"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class QueryServer:
+    """serves searches of Alex.library (an Alexandria with its library loaded) over HTTP.
+    pool - executor running processQuery (a ProcessPoolExecutor set up with initWorker)"""
+    REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               500: "Internal Server Error"}
+
+    def __init__(self, Alex, pool):
+        self.Alex = Alex
+        self.library = Alex.library
+        self.pool = pool
+        self.routes = {"/search": self.search, "/pages": self.pages, "/similar": self.similar, "/stats": self.stats}
+
+    async def processInput(self, text):
+        """lemmatised search words of text, worked out in the worker pool so the event loop stays free"""
+        return await asyncio.get_running_loop().run_in_executor(self.pool, processQuery, text)
+
+    def docID(self, params):
+        """docID from the 'doc' parameter, checked to be a document in the library"""
+        docID = intParam(params, "doc")
+        if docID is None or not 0 <= docID < len(self.library.myDocs) or self.library.myDocs.name(docID) is None:
+            raise RequestError(404, "no document " + str(params.get("doc")))
+
+        return docID
+
+    async def search(self, params):
+        text = params.get("q", "")
+        k = intParam(params, "k", 10)
+        searchWords = await self.processInput(text)
+
+        results = []
+        if params.get("pages") == "1":
+            # each document's best page comes back with it - +1 as page numbers are stored starting from 0
+            for docID, score, pages in self.library.searchWithPages(searchWords, k, 1):
+                results.append({"docID": docID, "name": self.library.myDocs.name(docID), "score": score,
+                                "page": pages[0][0] + 1})
+        else:
+            for docID, score in self.library.search(searchWords, k=k):
+                results.append({"docID": docID, "name": self.library.myDocs.name(docID), "score": score})
+
+        return {"query": text, "words": searchWords, "results": results}
+
+    async def pages(self, params):
+        docID = self.docID(params)
+        k = intParam(params, "k", 10)
+        searchWords = await self.processInput(params.get("q", ""))
+
+        # searchPages lists lowest match first
+        ranked = self.library.searchPages(docID, searchWords)[::-1][:k]
+
+        return {"docID": docID, "name": self.library.myDocs.name(docID), "words": searchWords,
+                "results": [{"page": page + 1, "score": float(score)} for page, score in ranked]}
+
+    async def similar(self, params):
+        docID = self.docID(params)
+        k = intParam(params, "k", 5)
+
+        return {"docID": docID, "name": self.library.myDocs.name(docID),
+                "results": [{"docID": otherID, "name": self.library.myDocs.name(otherID), "score": score}
+                            for otherID, score in self.library.getSimilarList(docID, k)]}
+
+    async def stats(self, params):
+        return {"documents": len(self.library), "words": len(self.library.masterDict),
+                "resultCache": self.library.resultCacheStats}
+
+    async def respond(self, method, target):
+        """returns (status, JSON-able body) for one request"""
+        if method not in ("GET", "HEAD"):
+            raise RequestError(405, "only GET is supported")
+
+        try:
+            url = urllib.parse.urlsplit(target)
+        except ValueError:
+            raise RequestError(400, "malformed request") from None
+        route = self.routes.get(url.path)
+        if route is None:
+            raise RequestError(404, "unknown path " + url.path)
+
+        params = dict(urllib.parse.parse_qsl(url.query))
+        return 200, await route(params)
+
+    async def handleConnection(self, reader, writer):
+        """serves requests on one connection until the client closes it (HTTP/1.1 keep-alive)"""
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+
+                # headers are read past - only Connection matters here
+                keepAlive = requestLine.rstrip().endswith(b"HTTP/1.1")
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    if name.strip().lower() == "connection":
+                        keepAlive = value.strip().lower() == "keep-alive"
+
+                # only a bad request line is the client's fault - errors in a handler are logged as server errors
+                try:
+                    method, target, version = requestLine.decode("latin-1").split()
+                except ValueError:
+                    method, target = "GET", None
+
+                try:
+                    if target is None:
+                        raise RequestError(400, "malformed request")
+                    status, body = await self.respond(method, target)
+                except RequestError as e:
+                    method, status, body = "GET", e.status, {"error": str(e)}
+                except Exception as e:
+                    logging.exception("In 'QueryServer' - request failed")
+                    method, status, body = "GET", 500, {"error": str(e)}
+
+                payload = json.dumps(body).encode("utf-8")
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n"
+                              "Connection: %s\r\n\r\n" % (status, self.REASONS[status], len(payload),
+                                                          "keep-alive" if keepAlive else "close")).encode("latin-1"))
+                if method != "HEAD":
+                    writer.write(payload)
+                await writer.drain()
+
+                if not keepAlive:
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handleConnection, host, port)
+        print("Serving", len(self.library), "documents on http://%s:%d" % (host, port))
+
+        async with server:
+            await server.serve_forever()
+
+
+def intParam(params, name, default=None):
+    """integer query parameter, default if missing"""
+    if name not in params:
+        return default
+
+    try:
+        return int(params[name])
+    except ValueError:
+        raise RequestError(400, "'" + name + "' must be a whole number") from None
+
+
+def loggedQueries(path="LogFile"):
+    """returns the raw queries recorded in the addLog file ('Search Conducted' lines)"""
+    queries = []
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("    ", 2)
+                if len(parts) == 3 and parts[1] == "[Search Conducted]" and parts[2].strip():
+                    queries.append(parts[2])
+
+    return queries
+
+
+async def loadTest(host, port, queries, numRequests=1000, concurrency=16, k=10):
+    """fires numRequests /search requests at the server from concurrency keep-alive connections (queries picked at
+    random from 'queries') and prints throughput and latency percentiles"""
+    latencies = []
+    failures = 0
+    remaining = numRequests
+
+    async def client():
+        nonlocal remaining, failures
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while remaining > 0:
+                remaining -= 1
+                target = "/search?" + urllib.parse.urlencode({"q": random.choice(queries), "k": k, "pages": 1})
+
+                start = time.perf_counter()
+                writer.write(("GET %s HTTP/1.1\r\nHost: %s\r\n\r\n" % (target, host)).encode("latin-1"))
+                await writer.drain()
+
+                status = int((await reader.readline()).split()[1])
+                length = 0
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                latencies.append(time.perf_counter() - start)
+
+                if status != 200:
+                    failures += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print("Requests:", len(latencies), "(" + str(failures), "failed) in", round(elapsed, 3), "s -",
+          round(len(latencies) / elapsed, 1), "requests/s")
+    for percentile in (50, 90, 99):
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        print("  p" + str(percentile) + " latency:", round(latencies[index] * 1000, 2), "ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Alexandria headless query server")
+    parser.add_argument("--index", default="library_index", help="library index directory (see Alexandria.saveLibrary)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) - 1),
+                        help="query processing processes (each loads its own copy of the model)")
+    parser.add_argument("--model", default="en_core_web_lg", help="spaCy model for query processing")
+    parser.add_argument("--cache-size", type=int, default=32, help="documents' page indexes kept loaded")
+    parser.add_argument("--load-test", action="store_true", help="load test a running server instead of serving")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--queries", default="LogFile", help="file of past queries to replay (addLog format)")
+    args = parser.parse_args()
+
+    if args.load_test:
+        queries = loggedQueries(args.queries) or ["flying passenger"]
+        asyncio.run(loadTest(args.host, args.port, queries, args.requests, args.concurrency))
+        return
+
+    # worker processes log through this process's sink
+    log.setupLogging(eventFile="LogFile", appFile="Alex.log", eventLevel=logging.INFO, shared=True)
+
+    # the library needs no model in this process - queries are processed by the workers
+    Alex = Alexandria(None)
+    if not Alex.loadLibrary(args.index, args.cache_size):
+        print("No library index at '" + args.index + "' - run main.py (or Alexandria.saveLibrary) to create one")
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(args.workers, initializer=initWorker,
+                                                initargs=(args.model, log.logQueue())) as pool:
+        try:
+            asyncio.run(QueryServer(Alex, pool).serve(args.host, args.port))
+        except KeyboardInterrupt:
+            print("Server stopped")
+
+
+if __name__ == '__main__':
+    main()
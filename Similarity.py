@@ -0,0 +1,90 @@
+"""Cosine similarity between the documents of a 'DocumentCollection' (see DocumentCollection.getSimilarList)"""
+
+import numpy as np
+from scipy import sparse
+
+
+def topKDescending(scores, k):
+    """returns indexes of the k highest scores (highest first, ties by index) without fully sorting - -inf scores
+    are never returned"""
+    k = min(k, int(np.count_nonzero(scores > -np.inf)))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.lexsort((top, -scores[top]))]
+
+
+class SimilarityEngine:
+    """document vectors (columns of a words x documents CSC matrix of raw frequencies) are L2 normalised once, so one
+    document against all the others is a single sparse matrix-vector product.
+    live - optional boolean mask, False for documents to leave out (removed ones)"""
+    def __init__(self, matrix, live=None):
+        matrix = sparse.csc_matrix(matrix)
+        self.numDocs = matrix.shape[1]
+        self.live = np.ones(self.numDocs, dtype=bool) if live is None else np.asarray(live, dtype=bool)
+
+        # empty (and left out) documents get a zero vector - similar to nothing
+        columnOfEntry = np.repeat(np.arange(self.numDocs), np.diff(matrix.indptr))
+        norms = np.sqrt(np.bincount(columnOfEntry, weights=matrix.data ** 2, minlength=self.numDocs))
+        scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=(norms > 0) & self.live)
+
+        # words x docs for picking out a document's vector, docs x words for scoring against all docs
+        # (index arrays copied - eliminate_zeros works in place and they belong to the collection)
+        self._byDoc = sparse.csc_matrix((matrix.data * scale[columnOfEntry], matrix.indices.copy(), matrix.indptr.copy()),
+                                        shape=matrix.shape)
+        self._byDoc.eliminate_zeros()
+        self._rows = self._byDoc.T.tocsr()
+
+        # filled in by allPairs - the k most similar docs (and scores) of every doc
+        self.topDocs = None
+        self.topScores = None
+
+    def similarities(self, docID):
+        """returns cosine similarity of docID with every document (-inf for itself and left out documents)"""
+        scores = (self._rows @ self._byDoc[:, docID]).toarray().ravel()
+        scores[~self.live] = -np.inf
+        scores[docID] = -np.inf
+
+        return scores
+
+    def similar(self, docID, k=None):
+        """returns (docIDs, scores) of the k documents most similar to docID, most similar first (all documents if
+        k is None). Answered from the allPairs table when it holds enough"""
+        if k is not None and self.topDocs is not None and k <= self.topDocs.shape[1]:
+            found = self.topDocs[docID, :k] >= 0
+            return self.topDocs[docID, :k][found], self.topScores[docID, :k][found]
+
+        scores = self.similarities(docID)
+        top = topKDescending(scores, self.numDocs if k is None else k)
+
+        return top, scores[top]
+
+    def allPairs(self, k, memoryBudget=256 * 2 ** 20):
+        """works out the k most similar documents for every document, in blocks of documents sized so each block's
+        similarity matrix stays within memoryBudget bytes. Kept in topDocs / topScores (docID -1 where a document
+        has fewer than k others to compare with)"""
+        self.topDocs = np.full((self.numDocs, k), -1, dtype=np.int64)
+        self.topScores = np.zeros((self.numDocs, k))
+
+        # sparse product plus its dense copy - allow 24 bytes per similarity
+        blockSize = max(1, int(memoryBudget // (24 * max(self.numDocs, 1))))
+
+        for start in range(0, self.numDocs, blockSize):
+            end = min(start + blockSize, self.numDocs)
+            block = (self._rows[start:end] @ self._byDoc).toarray()
+            block[:, ~self.live] = -np.inf
+            block[~self.live[start:end]] = -np.inf
+            block[np.arange(end - start), np.arange(start, end)] = -np.inf
+
+            # top k of every row at once - partial selection, then only those k sorted (ties by docID)
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k] if k < self.numDocs else \
+                np.tile(np.arange(self.numDocs), (end - start, 1))
+            topScores = np.take_along_axis(block, top, axis=1)
+            order = np.lexsort((top, -topScores), axis=-1)
+            top = np.take_along_axis(top, order, axis=1)
+            topScores = np.take_along_axis(topScores, order, axis=1)
+
+            found = topScores > -np.inf
+            self.topDocs[start:end, :top.shape[1]] = np.where(found, top, -1)
+            self.topScores[start:end, :top.shape[1]] = np.where(found, topScores, 0.0)
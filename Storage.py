@@ -0,0 +1,283 @@
+"""On-disk index format for a 'DocumentCollection' - replaces pickling the whole object graph.
+
+An index directory holds generations (gen-000001, gen-000002...) and a CURRENT file naming the live one, so a save
+never touches files an open index may have mapped. Each generation is a directory of separate segments, each a
+plain .npy array (no pickled objects, so safe to open from untrusted sources) apart from meta.json:
+    meta.json               - format name/version, counts and document names
+    vocab.bin / vocab_offsets.npy
+                            - utf-8 words back to back (in word index order) and where each one starts
+    docs_indptr/indices/data.npy
+                            - collection matrix of raw frequencies (CSC, words x documents)
+    doc_freq.npy, doc_lengths.npy
+                            - documents each word is in / words in each document
+    rows_indptr/docs/counts.npy, postings_docs/counts.npy, postings_ends.npy
+                            - the collection matrix again as rows (CSR, docID ordered) and each row's postings in impact
+                              order for the default scorer (see Index.InvertedIndex) with the end of its scoring ones
+    doc_words.npy, doc_word_start.npy
+                            - each document's own words (as word indexes) back to back and where each starts
+    pages_indptr/indices/data.npy, doc_page_start.npy
+                            - every document's page matrix (CSC, document words x pages) side by side and the first
+                              page column of each document
+    doc_has_positions.npy, pos_row_ptr/pages/offsets.npy, pos_blob.bin, doc_pos_entry_start/byte_start.npy
+                            - optional page positions (see Positions.PositionalIndex) of each document side by side -
+                              row starts (one more than the document's words, from doc_word_start[docID] + docID),
+                              entry pages, byte offsets (one more than its entries) and encoded positions
+Segments are opened with np.memmap so startup doesn't read the index, processes opening the same index share it
+through the OS page cache and a document's pages are only read when that document is loaded"""
+
+import json
+import os
+import shutil
+import numpy as np
+from numpy.lib.format import open_memmap
+from scipy import sparse
+from Index import InvertedIndex
+from Positions import PositionalIndex
+
+FORMAT_NAME = "alexandria-index"
+FORMAT_VERSION = 1
+
+
+def indexDtype(maxValue):
+    """int32 unless maxValue needs more - scipy keeps memory mapped index arrays as they are only if both the indices
+    and indptr of a matrix are int32 (anything else gets copied into memory)"""
+    return np.int32 if maxValue < np.iinfo(np.int32).max else np.int64
+
+
+def saveCollection(collection, path):
+    """writes DocumentCollection 'collection' to directory path (replacing any index already there).
+    Removed documents are compacted away first"""
+    if collection.numRemoved:
+        collection.compact()
+
+    os.makedirs(path, exist_ok=True)
+    generations = sorted(name for name in os.listdir(path) if name.startswith("gen-") and name[4:].isdigit())
+    generation = "gen-%06d" % (int(generations[-1][4:]) + 1 if generations else 1)
+
+    tempPath = os.path.join(path, generation + ".tmp")
+    if os.path.exists(tempPath):
+        shutil.rmtree(tempPath)
+    os.makedirs(tempPath)
+
+    def segment(name, array):
+        np.save(os.path.join(tempPath, name + ".npy"), np.ascontiguousarray(array), allow_pickle=False)
+
+    # only words still in a document are written - closed up to new indexes, kept in vocabulary ID order
+    liveWords = collection.myDocFreq > 0
+    newID = np.cumsum(liveWords) - 1
+    blob, offsets = collection.vocabulary.packed(np.flatnonzero(liveWords))
+    with open(os.path.join(tempPath, "vocab.bin"), "wb") as f:
+        f.write(blob)
+    segment("vocab_offsets", offsets)
+    numWords = len(offsets) - 1
+
+    matrix = collection.myArray
+    docsDtype = indexDtype(max(matrix.nnz, numWords))
+    segment("docs_indptr", matrix.indptr.astype(docsDtype))
+    segment("docs_indices", newID[matrix.indices].astype(docsDtype))
+    segment("docs_data", matrix.data)
+    segment("doc_freq", collection.myDocFreq[liveWords])
+    segment("doc_lengths", collection.myDocLengths)
+
+    # postings are saved in impact order for the default scorer, so opening the index doesn't sort them again - a
+    # collection searched with another scorer has its default one built here
+    scorer = type(collection).scorer
+    if repr(collection.scorer) == repr(scorer):
+        index = collection.index
+    else:
+        index = InvertedIndex(matrix, scorer, scorer.idf(len(collection), collection.myDocFreq),
+                              scorer.norms(collection.myDocLengths, collection.myLive))
+
+    # words no longer in a document have no entries, so their rows just close up
+    rowsIndptr = np.concatenate(([0], index.indptr[1:][liveWords]))
+    numScoring = (index.ends - index.indptr[:-1])[liveWords]
+    segment("rows_indptr", rowsIndptr.astype(docsDtype))
+    segment("rows_docs", index.counts.indices.astype(docsDtype))
+    segment("rows_counts", index.counts.data)
+    segment("postings_docs", index.postingDocs.astype(docsDtype))
+    segment("postings_counts", index.postingCounts)
+    segment("postings_ends", rowsIndptr[:-1] + numScoring)
+
+    # per document segments are written straight into place rather than concatenated in memory first
+    docs = collection.myDocs
+    sizes = np.array([docs.sizes(docID) for docID in range(len(docs))], dtype=np.int64).reshape(-1, 3)
+    docWordStart = np.concatenate(([0], np.cumsum(sizes[:, 0])))
+    docPageStart = np.concatenate(([0], np.cumsum(sizes[:, 1])))
+    pageNNZ = np.concatenate(([0], np.cumsum(sizes[:, 2])))
+    segment("doc_word_start", docWordStart)
+    segment("doc_page_start", docPageStart)
+
+    pagesDtype = indexDtype(pageNNZ[-1])
+    docWords = open_memmap(os.path.join(tempPath, "doc_words.npy"), mode="w+", dtype=np.int32,
+                           shape=(int(docWordStart[-1]),))
+    pagesIndptr = open_memmap(os.path.join(tempPath, "pages_indptr.npy"), mode="w+", dtype=pagesDtype,
+                              shape=(int(docPageStart[-1]) + 1,))
+    pagesIndices = open_memmap(os.path.join(tempPath, "pages_indices.npy"), mode="w+", dtype=pagesDtype,
+                               shape=(int(pageNNZ[-1]),))
+    pagesData = open_memmap(os.path.join(tempPath, "pages_data.npy"), mode="w+", dtype=np.float64,
+                            shape=(int(pageNNZ[-1]),))
+
+    # positions are only known once each document is loaded - the small arrays are gathered, the bytes streamed
+    hasPositions = np.zeros(len(docs), dtype=np.uint8)
+    posRowPtr, posPages, posOffsets = [], [], []
+    posEntryStart = np.zeros(len(docs) + 1, dtype=np.int64)
+    posByteStart = np.zeros(len(docs) + 1, dtype=np.int64)
+    posBlob = open(os.path.join(tempPath, "pos_blob.bin"), "wb")
+
+    pagesIndptr[0] = 0
+    for docID, doc in enumerate(docs):
+        docWords[docWordStart[docID]:docWordStart[docID + 1]] = newID[doc.myTermIDs]
+        pages = doc.myArray
+        pagesIndptr[docPageStart[docID] + 1:docPageStart[docID + 1] + 1] = pageNNZ[docID] + pages.indptr[1:]
+        pagesIndices[pageNNZ[docID]:pageNNZ[docID + 1]] = pages.indices
+        pagesData[pageNNZ[docID]:pageNNZ[docID + 1]] = pages.data
+
+        positions = doc.positions
+        docNumWords = int(sizes[docID, 0])
+        if positions is None:
+            positions = PositionalIndex(np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                                        np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.uint8))
+        else:
+            hasPositions[docID] = 1
+
+        # words added after the positions were built have no entries
+        posRowPtr.append(np.concatenate((positions.rowPtr,
+                                         np.full(docNumWords + 1 - len(positions.rowPtr), positions.rowPtr[-1]))))
+        posPages.append(positions.entryPages)
+        posOffsets.append(positions.offsets)
+        posBlob.write(np.asarray(positions.blob, dtype=np.uint8).tobytes())
+        posEntryStart[docID + 1] = posEntryStart[docID] + len(positions.entryPages)
+        posByteStart[docID + 1] = posByteStart[docID] + len(positions.blob)
+
+    for array in (docWords, pagesIndptr, pagesIndices, pagesData):
+        array.flush()
+    del docWords, pagesIndptr, pagesIndices, pagesData
+
+    posBlob.close()
+    segment("doc_has_positions", hasPositions)
+    segment("pos_row_ptr", np.concatenate(posRowPtr) if posRowPtr else np.zeros(0, dtype=np.int64))
+    segment("pos_pages", np.concatenate(posPages) if posPages else np.zeros(0, dtype=np.int64))
+    segment("pos_offsets", np.concatenate(posOffsets) if posOffsets else np.zeros(0, dtype=np.int64))
+    segment("doc_pos_entry_start", posEntryStart)
+    segment("doc_pos_byte_start", posByteStart)
+
+    # meta.json goes last - an index directory without it is incomplete
+    meta = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "numDocs": len(docs), "numWords": numWords,
+            "positions": True, "postingsScorer": repr(scorer), "docNames": [docs.name(docID) for docID in range(len(docs))]}
+    with open(os.path.join(tempPath, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    # switch CURRENT over to the finished generation
+    os.rename(tempPath, os.path.join(path, generation))
+    with open(os.path.join(path, "CURRENT.tmp"), "w") as f:
+        f.write(generation)
+    os.replace(os.path.join(path, "CURRENT.tmp"), os.path.join(path, "CURRENT"))
+
+    # the generation the collection was opened from (its documents are still loaded from there) and the one just
+    # replaced (another process may have it open) are kept - older ones go. A generation still mapped elsewhere
+    # can't be deleted on Windows, so it is tidied up by a later save instead
+    keep = set(generations[-1:])
+    if collection.myDocs.store is not None:
+        keep.add(os.path.basename(collection.myDocs.store.path))
+    for oldGeneration in generations:
+        if oldGeneration not in keep:
+            shutil.rmtree(os.path.join(path, oldGeneration), ignore_errors=True)
+
+
+class IndexStore:
+    """read side of an index directory written by saveCollection (its CURRENT generation).
+    Array segments are memory mapped (read only)"""
+    def __init__(self, path):
+        with open(os.path.join(path, "CURRENT"), "r") as f:
+            self.path = os.path.join(path, f.read().strip())
+
+        with open(os.path.join(self.path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+
+        if self.meta.get("format") != FORMAT_NAME:
+            raise ValueError("'" + path + "' is not an Alexandria index")
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError("Alexandria index version " + str(self.meta.get("version")) + " not supported")
+
+        self.docNames = self.meta["docNames"]
+        self._segments = {}
+
+    def segment(self, name):
+        """returns the named array segment, memory mapped on first use"""
+        if name not in self._segments:
+            self._segments[name] = np.load(os.path.join(self.path, name + ".npy"), mmap_mode="r", allow_pickle=False)
+
+        return self._segments[name]
+
+    def vocabBlob(self):
+        """returns (utf-8 bytes of all words back to back in index order, offsets array of where each starts)"""
+        with open(os.path.join(self.path, "vocab.bin"), "rb") as f:
+            blob = f.read()
+
+        return blob, self.segment("vocab_offsets")
+
+    def words(self):
+        """returns list of all words in index order"""
+        blob, offsets = self.vocabBlob()
+        offsets = offsets.tolist()
+        return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+    def docMatrix(self):
+        """returns the collection matrix (CSC, words x documents) over the memory mapped segments"""
+        return sparse.csc_matrix((self.segment("docs_data"), self.segment("docs_indices"), self.segment("docs_indptr")),
+                                 shape=(self.meta["numWords"], self.meta["numDocs"]), copy=False)
+
+    def postingsIndex(self, scorer, idf, norms):
+        """returns Index.InvertedIndex over the memory mapped postings if they were saved in impact order for scorer
+        (same repr), else None (the index is built from docMatrix instead)"""
+        if self.meta.get("postingsScorer") != repr(scorer):
+            return None
+
+        rows = sparse.csr_matrix((self.segment("rows_counts"), self.segment("rows_docs"), self.segment("rows_indptr")),
+                                 shape=(self.meta["numWords"], self.meta["numDocs"]), copy=False)
+
+        return InvertedIndex.fromPostings(rows, self.segment("postings_docs"), self.segment("postings_counts"),
+                                          self.segment("postings_ends"), scorer, idf, norms)
+
+    def documentSizes(self, docID):
+        """returns (number of words, number of pages, number of non-zeros) of document docID without loading it"""
+        wordStart = self.segment("doc_word_start")
+        pageStart = self.segment("doc_page_start")
+        pagesIndptr = self.segment("pages_indptr")
+
+        return (int(wordStart[docID + 1] - wordStart[docID]), int(pageStart[docID + 1] - pageStart[docID]),
+                int(pagesIndptr[pageStart[docID + 1]] - pagesIndptr[pageStart[docID]]))
+
+    def documentArrays(self, docID):
+        """returns (array of the document's words as word indexes, page matrix (CSC, document words x pages))"""
+        wordStart = self.segment("doc_word_start")
+        pageStart = self.segment("doc_page_start")
+        words = self.segment("doc_words")[wordStart[docID]:wordStart[docID + 1]]
+
+        indptr = self.segment("pages_indptr")[pageStart[docID]:pageStart[docID + 1] + 1]
+        start, end = indptr[0], indptr[-1]
+        pages = sparse.csc_matrix((self.segment("pages_data")[start:end], self.segment("pages_indices")[start:end],
+                                   indptr - start), shape=(len(words), len(indptr) - 1), copy=False)
+
+        return words, pages
+
+    def documentPositions(self, docID):
+        """returns the document's Positions.PositionalIndex (over the memory mapped segments), None if it has none or
+        the index was saved without positions"""
+        if not self.meta.get("positions") or not self.segment("doc_has_positions")[docID]:
+            return None
+
+        wordStart = self.segment("doc_word_start")
+        entryStart = self.segment("doc_pos_entry_start")
+        byteStart = self.segment("doc_pos_byte_start")
+
+        if "pos_blob" not in self._segments:
+            # np.memmap can't map an empty file
+            blobPath = os.path.join(self.path, "pos_blob.bin")
+            self._segments["pos_blob"] = np.memmap(blobPath, dtype=np.uint8, mode="r") \
+                if os.path.getsize(blobPath) else np.zeros(0, dtype=np.uint8)
+
+        return PositionalIndex(self.segment("pos_row_ptr")[wordStart[docID] + docID:wordStart[docID + 1] + docID + 1],
+                               self.segment("pos_pages")[entryStart[docID]:entryStart[docID + 1]],
+                               self.segment("pos_offsets")[entryStart[docID] + docID:entryStart[docID + 1] + docID + 1],
+                               self._segments["pos_blob"][byteStart[docID]:byteStart[docID + 1]])
@@ -1,10 +1,7 @@
 #external modules
-import pdfplumber
 import re
 import os
 import json
-from wordcloud import WordCloud, STOPWORDS
-import matplotlib.pyplot as plt
 
 
 #my modules
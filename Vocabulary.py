@@ -0,0 +1,203 @@
+"""Shared term vocabulary - each term of a 'DocumentCollection' and its documents stored once, with an integer ID"""
+
+import numpy as np
+from Index import growArray
+
+
+class Vocabulary:
+    """term <-> integer ID table shared by a collection and its documents, so they only need to hold term IDs.
+    IDs are given out in order of first appearance and never change.
+    Terms are kept as utf-8 bytes back to back in ID order (one blob plus offsets) rather than as Python strings.
+    Term -> ID lookups go through the terms grouped by length, each group a sorted fixed width numpy array searched with
+    np.searchsorted, so looking up a whole page or document of terms is a few vectorised calls. Terms added since the
+    groups were last rebuilt are found through a small dict until there are enough of them to merge in.
+    Also reads like the {word : row} dict 'masterDict' used to be"""
+
+    # merge recently added terms into the sorted groups once there are this many (or an eighth of the vocabulary)
+    MERGE_MIN = 4096
+
+    def __init__(self, terms=()):
+        self._blob = bytearray()
+        self._offsets = np.zeros((1024,), dtype=np.int64)
+        self.numTerms = 0
+
+        # {term length : (sorted fixed width terms, their IDs)} covering IDs below _numSorted
+        self._groups = {}
+        self._numSorted = 0
+        # {term : ID} for IDs from _numSorted on
+        self._recent = {}
+
+        self.addMany(terms)
+
+    @classmethod
+    def fromBlob(cls, blob, offsets):
+        """vocabulary over utf-8 terms stored back to back in ID order (e.g. read from an on-disk index) - the sorted
+        groups are only built on the first lookup"""
+        vocabulary = cls()
+        vocabulary._blob = bytearray(blob)
+        vocabulary.numTerms = len(offsets) - 1
+        vocabulary._offsets = np.array(offsets, dtype=np.int64)
+        vocabulary._groups = None
+
+        return vocabulary
+
+    def __getstate__(self):
+        # the sorted groups are rebuilt from the blob when next needed
+        state = self.__dict__.copy()
+        state["_offsets"] = self._offsets[:self.numTerms + 1].copy()
+        state["_groups"] = None
+        state["_numSorted"] = 0
+        state["_recent"] = {}
+        return state
+
+    def __len__(self):
+        return self.numTerms
+
+    def __iter__(self):
+        """terms in ID order"""
+        return iter(self.terms(np.arange(self.numTerms)))
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __getitem__(self, term):
+        termID = self.get(term)
+        if termID is None:
+            raise KeyError(term)
+
+        return termID
+
+    def get(self, term, default=None):
+        """returns ID of term, default if it isn't in the vocabulary"""
+        termID = int(self.idsOf([term])[0])
+        return default if termID < 0 else termID
+
+    def setdefault(self, term, default=None):
+        """returns ID of term, adding it if new (default is ignored - kept so the vocabulary reads like a dict)"""
+        return int(self.addMany([term])[0])
+
+    def items(self):
+        """(term, ID) pairs in ID order"""
+        return zip(self, range(self.numTerms))
+
+    def term(self, termID):
+        return self._blob[self._offsets[termID]:self._offsets[termID + 1]].decode("utf-8")
+
+    def terms(self, termIDs):
+        """returns list of the terms with IDs termIDs"""
+        offsets = self._offsets[np.asarray(termIDs, dtype=np.int64)[:, None] + [0, 1]].tolist()
+        blob = self._blob
+        return [blob[start:end].decode("utf-8") for start, end in offsets]
+
+    def idsOf(self, terms):
+        """returns int64 array of the IDs of terms (-1 for any not in the vocabulary)"""
+        self._sortGroups()
+        ids = np.full(len(terms), -1, dtype=np.int64)
+        if not len(terms):
+            return ids
+
+        encoded = np.array([term.encode("utf-8") for term in terms], dtype=object)
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+
+        for length in np.unique(lengths).tolist():
+            group = self._groups.get(length)
+            if group is None:
+                continue
+
+            sortedTerms, groupIDs = group
+            positions = np.flatnonzero(lengths == length)
+            keys = encoded[positions].astype(sortedTerms.dtype)
+            found = np.minimum(np.searchsorted(sortedTerms, keys), len(sortedTerms) - 1)
+            match = sortedTerms[found] == keys
+            ids[positions[match]] = groupIDs[found[match]]
+
+        if self._recent:
+            for i in np.flatnonzero(ids < 0).tolist():
+                ids[i] = self._recent.get(terms[i], -1)
+
+        return ids
+
+    def addMany(self, terms):
+        """returns int64 array of the IDs of terms, adding any that are new"""
+        terms = list(terms)
+        ids = self.idsOf(terms)
+
+        for i in np.flatnonzero(ids < 0).tolist():
+            term = terms[i]
+
+            # a term repeated within terms is only added once
+            termID = self._recent.get(term)
+            if termID is None:
+                termID = self.numTerms
+                encoded = term.encode("utf-8")
+                self._blob += encoded
+                self._offsets = growArray(self._offsets, self.numTerms + 2)
+                self._offsets[self.numTerms + 1] = self._offsets[self.numTerms] + len(encoded)
+                self.numTerms += 1
+                self._recent[term] = termID
+
+            ids[i] = termID
+
+        if len(self._recent) >= max(self.MERGE_MIN, self._numSorted // 8):
+            self._sortGroups(merge=True)
+
+        return ids
+
+    def add(self, term):
+        """returns ID of term, adding it if new"""
+        return int(self.addMany([term])[0])
+
+    def packed(self, termIDs=None):
+        """returns (utf-8 bytes of the terms with IDs termIDs back to back, int64 offsets of each) - all terms in ID
+        order if termIDs is None"""
+        if termIDs is None:
+            return bytes(self._blob), self._offsets[:self.numTerms + 1].copy()
+
+        termIDs = np.asarray(termIDs, dtype=np.int64)
+        starts = self._offsets[termIDs]
+        lengths = self._offsets[termIDs + 1] - starts
+        offsets = np.zeros(len(termIDs) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+
+        # index of every byte to copy - each term's start plus 0, 1, 2... along its length
+        index = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        blob = np.frombuffer(self._blob, dtype=np.uint8)[index].tobytes()
+
+        return blob, offsets
+
+    def _sortGroups(self, merge=False):
+        """builds the sorted groups if missing, and with merge takes in every term added since they were built"""
+        if self._groups is not None and not merge:
+            return
+
+        if self._groups is None:
+            self._groups = {}
+            self._numSorted = 0
+
+        start, end = self._numSorted, self.numTerms
+        newIDs = np.arange(start, end)
+        lengths = self._offsets[start + 1:end + 1] - self._offsets[start:end]
+        blob = np.frombuffer(self._blob, dtype=np.uint8)
+
+        for length in np.unique(lengths).tolist():
+            # the empty term can't be held in a fixed width array - it is looked up through _recent
+            if length == 0:
+                self._recent[""] = int(newIDs[lengths == 0][0])
+                continue
+
+            ids = newIDs[lengths == length]
+            terms = blob[self._offsets[ids][:, None] + np.arange(length)].view("S" + str(length)).ravel()
+
+            if length in self._groups:
+                oldTerms, oldIDs = self._groups[length]
+                terms = np.concatenate((oldTerms, terms))
+                ids = np.concatenate((oldIDs, ids))
+
+            order = np.argsort(terms, kind="stable")
+            self._groups[length] = (terms[order], ids[order])
+
+        # the blob can't grow while a numpy view of it exists
+        del blob
+
+        self._numSorted = end
+        self._recent = {term: termID for term, termID in self._recent.items() if termID >= end or not term}
@@ -0,0 +1,143 @@
+"""Word cloud images of documents - rendered straight from word frequencies (no text is built up for wordcloud to split
+again), in a pool of worker processes so they can be made ahead of being asked for (e.g. as documents are processed or
+while search results are on screen), and kept as PNG thumbnails in a size bounded cache directory named by each
+document's content hash - an unchanged document's cloud is only ever rendered once and a changed one gets a new one"""
+
+import concurrent.futures
+import hashlib
+import os
+import threading
+import numpy as np
+
+# default image size (pixels) - main.py shows clouds at up to 900 x 600
+WIDTH = 900
+HEIGHT = 600
+# words drawn in a cloud (wordcloud's own default) - only the most frequent are sent to be rendered
+MAX_WORDS = 200
+
+
+def topFrequencies(words, freqs, maxWords=MAX_WORDS):
+    """returns {word : frequency} of the maxWords most frequent words (partial selection, no full sort)"""
+    freqs = np.asarray(freqs, dtype=np.float64)
+    top = np.arange(len(freqs))
+    if maxWords < len(freqs):
+        top = np.argpartition(-freqs, maxWords - 1)[:maxWords]
+
+    return {words[i]: float(freqs[i]) for i in top.tolist()}
+
+
+def contentHash(words, freqs):
+    """returns sha256 hex digest of a document's words and their total frequencies (in row order, which is the same
+    however the document was loaded)"""
+    digest = hashlib.sha256()
+    digest.update("\0".join(words).encode("utf-8"))
+    digest.update(np.asarray(freqs, dtype=np.float64).tobytes())
+
+    return digest.hexdigest()
+
+
+def renderWordcloud(frequencies, width=WIDTH, height=HEIGHT):
+    """returns Pillow Image of a word cloud of {word : frequency}"""
+    from wordcloud import WordCloud
+
+    wordcloud = WordCloud(width=width, height=height, random_state=1, collocations=False, colormap="Blues",
+                          max_words=MAX_WORDS)
+
+    return wordcloud.generate_from_frequencies(frequencies).to_image()
+
+
+def renderToFile(frequencies, width, height, path):
+    """worker process task - renders a cloud and saves it as PNG at path (through a temporary file, so a reader never
+    sees half an image). Returns path"""
+    renderWordcloud(frequencies, width, height).save(path + ".tmp", format="PNG")
+    os.replace(path + ".tmp", path)
+
+    return path
+
+
+class WordcloudCache:
+    """directory of word cloud PNGs named '<content hash>_<width>x<height>.png', holding at most maxBytes of them -
+    the least recently used (by modification time, refreshed whenever an image is used) are deleted first.
+    workers - processes rendering clouds in the background (see submit), started on first use. With 0 clouds are
+    rendered in the calling thread when asked for"""
+    def __init__(self, path=r"Processed/wordclouds", maxBytes=64 * 2 ** 20, width=WIDTH, height=HEIGHT, workers=1):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.width = width
+        self.height = height
+        self.workers = workers
+        os.makedirs(path, exist_ok=True)
+
+        self._pool = None
+        # {file path : future} of background renders not yet finished
+        self._pending = {}
+        # trim runs on the pool's thread as well as the caller's
+        self._trimLock = threading.Lock()
+
+    def filePath(self, doc):
+        """returns path the cloud of 'Document' doc is cached at"""
+        return os.path.join(self.path, "%s_%dx%d.png" % (doc.contentHash, self.width, self.height))
+
+    def submit(self, doc):
+        """starts rendering the cloud of 'Document' doc in the background, unless it is cached or on its way"""
+        path = self.filePath(doc)
+        if self.workers <= 0 or path in self._pending or os.path.exists(path):
+            return
+
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+
+        future = self._pool.submit(renderToFile, topFrequencies(*doc.getWordFreqArrays()), self.width, self.height,
+                                   path)
+        self._pending[path] = future
+        future.add_done_callback(lambda future: self._finished(path, future))
+
+    def _finished(self, path, future):
+        # runs on the pool's thread once a render is done - a failed one is rendered again (raising) if asked for
+        self._pending.pop(path, None)
+        if not future.cancelled() and future.exception() is None:
+            self.trim()
+
+    def get(self, doc):
+        """returns Pillow Image of the cloud of 'Document' doc - from the cache, once its background render finishes,
+        or rendered here"""
+        from PIL import Image
+
+        path = self.filePath(doc)
+        future = self._pending.get(path)
+        if future is not None:
+            future.result()
+
+        if os.path.exists(path):
+            # most recently used is kept longest
+            os.utime(path)
+        else:
+            renderToFile(topFrequencies(*doc.getWordFreqArrays()), self.width, self.height, path)
+            self.trim()
+
+        # read in full so the file isn't held open (and can be trimmed)
+        image = Image.open(path)
+        image.load()
+
+        return image
+
+    def trim(self):
+        """deletes least recently used images until the cache holds at most maxBytes"""
+        with self._trimLock:
+            with os.scandir(self.path) as items:
+                files = [(item.stat().st_mtime, item.stat().st_size, item.path) for item in items
+                         if item.name.endswith(".png")]
+
+            total = sum(size for mtime, size, path in files)
+            for mtime, size, path in sorted(files):
+                if total <= self.maxBytes:
+                    break
+
+                os.remove(path)
+                total -= size
+
+    def close(self):
+        """stops the background workers - renders not yet started are dropped"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -1,11 +1,153 @@
-"""provides method to amend line to global log file"""
+"""provides method to amend line to global log file.
+Lines are handed to a background thread (LogSink) which writes them in batches, so callers never wait on the file.
+setupLogging connects this and the standard 'logging' module (e.g. 'Alex.log') to the same sink; worker processes
+send their records to the parent's sink with forwardLogging"""
 
+import atexit
 import datetime
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import threading
 
+# addLog events go through this logger and end up in 'LogFile' (it doesn't pass them up to the root logger)
+eventLogger = logging.getLogger("alexandria.events")
+eventLogger.propagate = False
 
-def addLog(event, freeText):
-    myFile = open(("LogFile"), "a")
-    myFile.write(str(datetime.datetime.now())+ "    "
-                 + "[" + event + "]" + "    "
-                 + freeText + "\n")
-    myFile.close()
\ No newline at end of file
+# the running sink (None until setupLogging, or the first addLog, starts one - False in a forwarding worker)
+_sink = None
+
+
+def addLog(event, freeText, level=logging.INFO):
+    """logs freeText (anything - only turned into a string if the level is being logged) under event"""
+    if _sink is None:
+        setupLogging(appFile=None)
+
+    if eventLogger.isEnabledFor(level):
+        eventLogger.log(level, "%s", freeText, extra={"event": event})
+
+
+class EventFormatter(logging.Formatter):
+    """'LogFile' line format - timestamp    [event]    freeText"""
+    def format(self, record):
+        return (str(datetime.datetime.fromtimestamp(record.created)) + "    "
+                + "[" + getattr(record, "event", record.levelname) + "]" + "    "
+                + record.getMessage())
+
+
+class BatchedFileHandler(logging.handlers.RotatingFileHandler):
+    """rotating log file that only flushes when LogSink finishes a batch rather than after every line"""
+    def flush(self):
+        pass
+
+    def flushBatch(self):
+        super().flush()
+
+
+class LogSink:
+    """background thread taking log records off a queue and passing them to its handlers. Everything waiting in the
+    queue (up to batchSize records) is written before the files are flushed"""
+    def __init__(self, handlers, batchSize=256, shared=False):
+        # a multiprocessing queue if other processes log through this sink (see forwardLogging)
+        self.queue = multiprocessing.Queue() if shared else queue.Queue()
+        self.handlers = handlers
+        self.batchSize = batchSize
+        self._thread = threading.Thread(target=self._run, name="LogSink", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        running = True
+        while running:
+            try:
+                batch = [self.queue.get()]
+            except (EOFError, OSError):
+                # shared queue closed down at exit - everything sent has been read
+                break
+
+            try:
+                while len(batch) < self.batchSize:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            for record in batch:
+                # None is the stop marker
+                if record is None:
+                    running = False
+                    continue
+
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+
+            for handler in self.handlers:
+                handler.flushBatch()
+
+    def stop(self):
+        """writes out everything queued so far, then stops the thread and closes the files"""
+        self.queue.put(None)
+        self._thread.join()
+
+        for handler in self.handlers:
+            handler.flushBatch()
+            handler.close()
+
+
+def setupLogging(eventFile="LogFile", appFile="Alex.log", level=logging.DEBUG, eventLevel=logging.DEBUG,
+                 maxBytes=5 * 2 ** 20, backupCount=3, shared=False):
+    """starts the background log sink. addLog events go to eventFile (at eventLevel and above) and, unless appFile is
+    None, the root logger (standard 'logging' calls) goes to appFile at level and above. Files rotate at maxBytes,
+    keeping backupCount old copies. shared - let worker processes log through this sink (see logQueue)"""
+    global _sink
+
+    if _sink:
+        _sink.stop()
+
+    eventHandler = BatchedFileHandler(eventFile, maxBytes=maxBytes, backupCount=backupCount)
+    eventHandler.setFormatter(EventFormatter())
+    eventHandler.addFilter(logging.Filter(eventLogger.name))
+    handlers = [eventHandler]
+
+    if appFile is not None:
+        appHandler = BatchedFileHandler(appFile, maxBytes=maxBytes, backupCount=backupCount)
+        appHandler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        appHandler.addFilter(lambda record: not record.name.startswith(eventLogger.name))
+        handlers.append(appHandler)
+
+    _sink = LogSink(handlers, shared=shared)
+
+    eventLogger.handlers = [logging.handlers.QueueHandler(_sink.queue)]
+    eventLogger.setLevel(eventLevel)
+
+    if appFile is not None:
+        root = logging.getLogger()
+        root.handlers = [logging.handlers.QueueHandler(_sink.queue)]
+        root.setLevel(level)
+
+
+def logQueue():
+    """returns the queue of a sink started with shared=True, for passing to worker processes"""
+    return _sink.queue
+
+
+def forwardLogging(logQueue, level=logging.DEBUG):
+    """for a worker process - sends its addLog events and root logger records through logQueue to the parent's sink
+    rather than opening the log files itself (several processes appending and rotating the same file would garble it)"""
+    global _sink
+
+    # the parent owns the files - nothing is started here
+    _sink = False
+
+    eventLogger.handlers = [logging.handlers.QueueHandler(logQueue)]
+    eventLogger.setLevel(level)
+
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(logQueue)]
+    root.setLevel(level)
+
+
+@atexit.register
+def _stopSink():
+    if _sink:
+        _sink.stop()
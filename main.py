@@ -1,4 +1,3 @@
-import spacy
 import time
 import pickle
 import PySimpleGUI as sg
@@ -6,18 +5,35 @@ import io
 import logging
 import datetime
 
-logging.basicConfig(filename='Alex.log', level=logging.DEBUG)
-logging.info(f"Started - {datetime.datetime.now()}")
+# My Modules
+from log import setupLogging
 
 # requires following in terminal
 # python -m spacy download en_core_web_lg
 
-# My Modules
-#from log import addLog
 from Alexandria import Document, DocumentCollection, Alexandria
+from Model import ModelLoader, QueryLookup
+from WordClouds import WordcloudCache
 
 from Util import *
 
+# number of processes extracting pdf text when processing documents (spaCy itself stays in this process, as each
+# extra nlp process loads its own copy of the model)
+INGEST_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+
+# pages (and documents) with the search words as a phrase or within this many words of each other rank higher -
+# needs the page positions saved when processing documents
+PROXIMITY_WINDOW = 8
+
+# tokens the nlp model has processed for past queries - lets simple queries be answered before the model has loaded
+QUERY_LOOKUP = "query_lookup.json"
+
+# word clouds are rendered by this many background processes (for newly processed documents and for search results
+# while they are on screen) and cached as images of this size, up to this many bytes
+WORDCLOUD_WORKERS = 1
+WORDCLOUD_SIZE = (900, 600)
+WORDCLOUD_CACHE_BYTES = 64 * 2 ** 20
+
 
 def setupGUI():
     """Sets up the GUI window layout"""
@@ -64,26 +80,40 @@ def yesNoBox():
 
 if __name__ == '__main__':
 
+    # 'Alex.log' and the addLog 'LogFile' are written by a background thread (set eventLevel=logging.INFO to leave out
+    # the per word search lines). Set up here rather than on import - worker processes re-import this module on
+    # Windows and must not open (and rotate) the same files
+    setupLogging(eventFile="LogFile", appFile="Alex.log", level=logging.DEBUG, eventLevel=logging.DEBUG)
+    logging.info(f"Started - {datetime.datetime.now()}")
+
     #setup GUI and return handle for event loop below
     window = setupGUI()
 
-    start = time.process_time()
-    #create wrapper Alexandria object and pass nlp model
-    Alex = Alexandria(spacy.load("en_core_web_lg"))
-    print("Time taken for nlp model load:", time.process_time() - start)
+    start = time.perf_counter()
+    #create wrapper Alexandria object - the nlp model loads in the background while the library is opened, and is
+    #only waited for when a query (or processing documents) needs it
+    Alex = Alexandria(ModelLoader("en_core_web_lg"), queryLookup=QueryLookup.load(QUERY_LOOKUP),
+                      wordclouds=WordcloudCache(maxBytes=WORDCLOUD_CACHE_BYTES, width=WORDCLOUD_SIZE[0],
+                                                height=WORDCLOUD_SIZE[1], workers=WORDCLOUD_WORKERS))
 
     #load library (A DocumentCollection object) into Alexandria wrapper
-    if Alex.loadLibraryFromPickle('library_pickled'):
+    if Alex.loadLibrary('library_index'):
         print ("Library loaded from file successfully")
+    elif Alex.loadLibraryFromPickle('library_pickled'):
+        #older pickled library - convert it to the index format for next time
+        print ("Library loaded from pickle file, converting to index")
+        Alex.saveLibrary("library_index")
     else:
         print ("Library not found, generating from scratch")
-        Alex.processDocs("TestDocs")
-        Alex.createLibrary()
-        Alex.saveLibraryToPickle("library_pickled")
+        #only pdfs not already in 'Processed' (per its manifest) need processing before the library is built
+        Alex.syncDocs("TestDocs", workers=INGEST_WORKERS, positions=True)
+        Alex.saveLibrary("library_index")
+
+    print("Time taken to open library:", time.perf_counter() - start)
 
     #some diagnostic functions
     print ("Number of unique words in document library: ", len(Alex.library.masterDict))
-    print ("Number of Documents in Library: ", len(Alex.library.myDocs))
+    print ("Number of Documents in Library: ", len(Alex.library))
 
     #setup variable for opening file
     result1 = None
@@ -99,33 +129,47 @@ if __name__ == '__main__':
         if event == '_Search_':
             start = time.process_time()
 
+            if not Alex.modelReady:
+                print("NLP model still loading - simple searches are answered from the lookup table")
+
             #pre-process the user input search text
             searchWords = Alex.processInput(values['-INPUT-'])
             print("Searching for the tokens: ", searchWords)
 
-            #request the ordered list of documents from search term
-            searchList = Alex.library.search(searchWords)
+            #request the top two documents for the search term, each with its best page, in one go (only documents
+            #containing a search word come back)
+            searchList = Alex.library.searchWithPages(searchWords, k=2, m=1, window=PROXIMITY_WINDOW)
 
-            #update current search outputs
-            result1 = searchList[0][0] # this is a docID in the library
-            result2 = searchList[1][0] # this is a docID in the library
-            doc1: Document = Alex.library.myDocs[result1]  # this is the actual doc
-            doc2: Document = Alex.library.myDocs[result2]  # this is the actual doc
+            result1 = None
+            result2 = None
+            window['-OUTPUT2-'].update("")
 
             #output to GUI - The +1 is due to page numbers being stored in array as elements (starting 0)
-            if searchList[0][1] == 0:
+            if len(searchList) == 0 or searchList[0][1] == 0:
                 window['-OUTPUT1-'].update("Search words not found - try a different search")
 
             else:
+                #update current search outputs
+                result1 = searchList[0][0] # this is a docID in the library
+                doc1: Document = Alex.library.myDocs[result1]  # this is the actual doc
+
                 window['-OUTPUT1-'].update(str(doc1.myName) + " - 100%" + "        " +
-                                       "Page " + str(doc1.search(searchWords)[-1][0] + 1))
+                                       "Page " + str(searchList[0][2][0][0] + 1))
+
+                if len(searchList) > 1:
+                    result2 = searchList[1][0] # this is a docID in the library
+                    doc2: Document = Alex.library.myDocs[result2]  # this is the actual doc
 
-                match = round(searchList[1][1] / searchList[0][1] * 100)
+                    match = round(searchList[1][1] / searchList[0][1] * 100)
 
-                window['-OUTPUT2-'].update(str(doc2.myName) + " - " + str(match) + "%" + "        " +
-                                       "Page " + str(doc2.search(searchWords)[-1][0] + 1))
+                    window['-OUTPUT2-'].update(str(doc2.myName) + " - " + str(match) + "%" + "        " +
+                                           "Page " + str(searchList[1][2][0][0] + 1))
+
+                #word clouds of the results are made in the background while they are read
+                Alex.renderWordclouds([docID for docID, score, pages in searchList])
 
             print("Time taken for search:", time.process_time() - start)
+            print("Search result cache:", Alex.library.resultCacheStats)
 
         # Open the file in default viewer
         if event == '_Open1_':
@@ -139,31 +183,44 @@ if __name__ == '__main__':
 
         if event == '_OpenSim1_':
             if result1 != None:
-                similarDoc1 = Alex.library.myDocs[Alex.library.getSimilarList(result1)[0][0]]
-                os.startfile("C:/Users/Hp/PycharmProjects/AlexandriaDocuments/TestDocs/" + str(similarDoc1.myName) +".pdf")
+                #only the closest document is needed (and just its name, so it isn't loaded)
+                similarList1 = Alex.library.getSimilarList(result1, k=1)
+                if similarList1:
+                    similarName1 = Alex.library.myDocs.name(similarList1[0][0])
+                    os.startfile("C:/Users/Hp/PycharmProjects/AlexandriaDocuments/TestDocs/" + str(similarName1) +".pdf")
 
         if event == '_OpenSim2_':
             if result2 != None:
-                similarDoc2 = Alex.library.myDocs[Alex.library.getSimilarList(result2)[0][0]]
-                os.startfile("C:/Users/Hp/PycharmProjects/AlexandriaDocuments/TestDocs/" + str(similarDoc2.myName) +".pdf")
+                #only the closest document is needed (and just its name, so it isn't loaded)
+                similarList2 = Alex.library.getSimilarList(result2, k=1)
+                if similarList2:
+                    similarName2 = Alex.library.myDocs.name(similarList2[0][0])
+                    os.startfile("C:/Users/Hp/PycharmProjects/AlexandriaDocuments/TestDocs/" + str(similarName2) +".pdf")
 
         if event == '_Wordcloud1_':
             if result1 != None:
-                displayImage(doc1.myName + " Wordcloud", doc1.returnWordcloud())
+                displayImage(doc1.myName + " Wordcloud", doc1.returnWordcloud(Alex.wordclouds))
 
         if event == '_Wordcloud2_':
             if result2 != None:
-                displayImage(doc2.myName + " Wordcloud", doc2.returnWordcloud())
+                displayImage(doc2.myName + " Wordcloud", doc2.returnWordcloud(Alex.wordclouds))
 
         if event == '_Process_':
 
             if yesNoBox():
-                #take all documents in 'TestDocs' and pre-process into 'Processed' folder
-                Alex.processDocs("TestDocs")
+                #pre-process new/changed documents in 'TestDocs' into 'Processed' folder and update the library to match
+                if Alex.syncDocs("TestDocs", workers=INGEST_WORKERS, positions=True):
+
+                    #docIDs of current results may have moved
+                    result1 = None
+                    result2 = None
 
-                #need to update the library and save it to pickle file for later access
-                Alex.createLibrary()
-                Alex.saveLibraryToPickle("library_pickled")
+                    #save library to index for later access
+                    Alex.saveLibrary("library_index")
 
     # Finish up by removing from the screen
     window.close()
+
+    #keep what the model taught the lookup table for next startup
+    Alex.queryLookup.save(QUERY_LOOKUP)
+    Alex.wordclouds.close()